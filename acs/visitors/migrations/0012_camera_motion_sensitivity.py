@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0011_event_opened_manually'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='motion_sensitivity',
+            field=models.FloatField(blank=True, help_text='Share of changed pixels that starts plate recognition, empty - default.', null=True, verbose_name='motion sensitivity'),
+        ),
+    ]
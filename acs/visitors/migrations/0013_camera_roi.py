@@ -0,0 +1,34 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:04
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0012_camera_motion_sensitivity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='roi_x_max',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='ROI right border'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='roi_x_min',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='ROI left border'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='roi_y_max',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='ROI bottom border'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='roi_y_min',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='ROI top border'),
+        ),
+    ]
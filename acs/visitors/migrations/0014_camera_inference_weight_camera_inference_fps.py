@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 13:52
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0013_camera_roi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='inference_fps',
+            field=models.FloatField(blank=True, help_text='Frames per second sent to plate recognition, empty - unlimited.', null=True, validators=[django.core.validators.MinValueValidator(0.1)], verbose_name='inference frame rate'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='inference_weight',
+            field=models.FloatField(blank=True, help_text='Share of plate recognition relative to other cameras, e.g. 3 for an entrance lane, empty - default.', null=True, validators=[django.core.validators.MinValueValidator(0.1)], verbose_name='inference weight'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0014_camera_inference_weight_camera_inference_fps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='updated at'),
+            preserve_default=False,
+        ),
+    ]
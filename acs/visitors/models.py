@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
 from django.utils import timezone
@@ -170,11 +171,42 @@ class Camera(models.Model):
     username = models.CharField(_('username'), max_length=100, blank=True)
     password = models.CharField(_('password'), max_length=100, blank=True)
     is_entrance = models.BooleanField(_('is entrance'), default=False)
+    motion_sensitivity = models.FloatField(
+        _('motion sensitivity'), blank=True, null=True,
+        help_text=_('Share of changed pixels that starts plate recognition, empty - default.'),
+    )
+    roi_x_min = models.FloatField(_('ROI left border'), blank=True, null=True,
+                                  validators=[MinValueValidator(0), MaxValueValidator(1)])
+    roi_x_max = models.FloatField(_('ROI right border'), blank=True, null=True,
+                                  validators=[MinValueValidator(0), MaxValueValidator(1)])
+    roi_y_min = models.FloatField(_('ROI top border'), blank=True, null=True,
+                                  validators=[MinValueValidator(0), MaxValueValidator(1)])
+    roi_y_max = models.FloatField(_('ROI bottom border'), blank=True, null=True,
+                                  validators=[MinValueValidator(0), MaxValueValidator(1)])
+    inference_weight = models.FloatField(
+        _('inference weight'), blank=True, null=True, validators=[MinValueValidator(0.1)],
+        help_text=_('Share of plate recognition relative to other cameras, e.g. 3 for an entrance lane, '
+                    'empty - default.'),
+    )
+    inference_fps = models.FloatField(
+        _('inference frame rate'), blank=True, null=True, validators=[MinValueValidator(0.1)],
+        help_text=_('Frames per second sent to plate recognition, empty - unlimited.'),
+    )
     gate = models.ForeignKey(Gate, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('gate'))
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        roi = (self.roi_x_min, self.roi_x_max, self.roi_y_min, self.roi_y_max)
+        if any(border is not None for border in roi):
+            if any(border is None for border in roi):
+                raise ValidationError(_("All ROI borders must be set, or none of them."))
+            if self.roi_x_min >= self.roi_x_max or self.roi_y_min >= self.roi_y_max:
+                raise ValidationError(_("ROI minimum border must be less than maximum."))
+        super().clean()
+
     def _construct_url(self, protocol, path):
         auth = f'{self.username}:{self.password}@' if self.username or self.password else ''
         return f'{protocol}://{auth}{self.stream_ip}:{self.stream_port if protocol == "rtsp" else 80}/{path.lstrip("/") or ""}'
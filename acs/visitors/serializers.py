@@ -9,7 +9,8 @@ class GateSerializer(serializers.ModelSerializer):
 class CameraSerializer(serializers.ModelSerializer):
     class Meta:
         model = Camera
-        fields = ['camera_id', 'name', 'stream_ip', 'stream_port', 'stream_path', 'mjpeg_path', 'mjpeg_url', 'username', 'password']
+        fields = ['camera_id', 'name', 'stream_ip', 'stream_port', 'stream_path', 'mjpeg_path', 'mjpeg_url', 'username', 'password', 'motion_sensitivity',
+                  'roi_x_min', 'roi_x_max', 'roi_y_min', 'roi_y_max', 'inference_weight', 'inference_fps']
 
 class StreamToGateSerializer(serializers.ModelSerializer):
     gate_id = serializers.UUIDField(source='gate.gate_id')
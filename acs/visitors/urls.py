@@ -7,6 +7,7 @@ urlpatterns = [
     path('camera/<uuid:camera_id>/events/stream/', views.EventStream.as_view(), name='event_stream'),
     path('gates/', views.GateListView.as_view(), name='gate-list'),
     path('streams/', views.StreamListView.as_view(), name='stream-list'),
+    path('streams/version/', views.StreamVersionView.as_view(), name='stream-version'),
     path('stream-to-gate-mapping/', views.StreamToGateMappingView.as_view(), name='stream-to-gate-mapping'),
     path('lpr-event/', views.LPREventView.as_view(), name='lpr_event'),
     path('debug/media-files/', views.list_media_files, name='list_media_files'),
@@ -16,6 +16,7 @@ from asgiref.sync import async_to_sync
 from django.core.files.base import ContentFile
 from django.db.models import Q
 import base64
+import hashlib
 import json
 import os
 from datetime import timedelta
@@ -112,6 +113,16 @@ class StreamListView(APIView):
         return Response(serializer.data)
 
 
+class StreamVersionView(APIView):
+    # changes whenever a camera is added, edited or deleted, lpr polls it to reload only changed cameras
+    def get(self, request):
+        cameras = Camera.objects.order_by('camera_id').values_list('camera_id', 'updated_at')
+        digest = hashlib.md5()
+        for camera_id, updated_at in cameras:
+            digest.update(f'{camera_id}:{updated_at.isoformat()};'.encode())
+        return Response({'version': digest.hexdigest()})
+
+
 class StreamToGateMappingView(APIView):
     def get(self, request):
         cameras = Camera.objects.select_related('gate').filter(gate__isnull=False).all()
@@ -148,8 +159,12 @@ class LPREventView(APIView):
             timestamp = serializer.validated_data['timestamp']
 
             if not is_new_event:
-                # Update the timestamp of the last event with the same camera_id
-                last_event = Event.objects.filter(camera_id=camera_id).order_by('-timestamp').first()
+                # Update the timestamp of the last event with the same camera_id and plate,
+                # lpr tracks several vehicles per camera
+                last_event = Event.objects.filter(
+                    camera_id=camera_id,
+                    license_plate=serializer.validated_data['license_plate'],
+                ).order_by('-timestamp').first()
                 if last_event:
                     last_event.timestamp = timestamp
                     last_event.save()
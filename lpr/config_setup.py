@@ -1,10 +1,14 @@
 import requests
 import logging
+import time
+from threading import Thread
 from uuid import UUID
-from typing import Dict, Callable
+from typing import Dict, Callable, Optional, Tuple
 
 from gate.camera import CameraRelay
-from stream.streams import Stream
+from sharding import ShardMembership
+from stream.streams import FrameSource, Stream
+from stream.workers import CaptureWorkers
 from predictors.detector import Detector
 from data.config import config
 
@@ -17,7 +21,57 @@ def fetch_data(endpoint: str) -> dict:
     response.raise_for_status()
     return response.json()
 
-def setup_configuration(on_event: Callable):
+def parse_roi(stream: dict) -> Optional[dict]:
+    roi = {
+        'x_min': stream.get('roi_x_min'),
+        'x_max': stream.get('roi_x_max'),
+        'y_min': stream.get('roi_y_min'),
+        'y_max': stream.get('roi_y_max'),
+    }
+    # camera without roi falls back to detector.recognition_borders
+    if any(value is None for value in roi.values()):
+        return None
+    return roi
+
+def fetch_stream_to_gate() -> Dict[UUID, UUID]:
+    stream_to_gate_data = fetch_data("stream-to-gate-mapping/")
+    logging.info(f'stream_to_gate mapping: {stream_to_gate_data}')
+    return {UUID(item['camera_id']): UUID(item['gate_id']) for item in stream_to_gate_data if item}
+
+def fetch_cameras() -> Dict[UUID, dict]:
+    return {UUID(stream['camera_id']): stream for stream in fetch_data("streams/")}
+
+def fetch_version() -> str:
+    # changes whenever a camera is added, edited or deleted in the ACS
+    return fetch_data("streams/version/")['version']
+
+def open_streams(cameras: Dict[UUID, dict], on_frame: Optional[Callable] = None,
+                 capture_workers: Optional[CaptureWorkers] = None) -> Dict[UUID, FrameSource]:
+    kwargs = {
+        uuid: {
+            'ip': stream['stream_ip'],
+            'port': stream['stream_port'],
+            'link': stream['stream_path'],
+            'user': stream['username'],
+            'password': stream['password'],
+        } for uuid, stream in cameras.items()
+    }
+    if capture_workers is not None:
+        return capture_workers.open(kwargs)
+    return {uuid: Stream(uuid=uuid, on_frame=on_frame, **stream_kwargs) for uuid, stream_kwargs in kwargs.items()}
+
+def build_detectors(cameras: Dict[UUID, dict]) -> Dict[UUID, Detector]:
+    return {
+        uuid: Detector(
+            uuid,
+            roi=parse_roi(stream),
+            motion_sensitivity=stream.get('motion_sensitivity'),
+            inference_weight=stream.get('inference_weight'),
+            inference_fps=stream.get('inference_fps'),
+        ) for uuid, stream in cameras.items()
+    }
+
+def fetch_configuration(shard: Optional[ShardMembership] = None) -> Tuple[Dict[UUID, UUID], Dict[UUID, dict]]:
     # gates_data = fetch_data("gates/")
     # gates: Dict[UUID, CameraRelay] = {
     #     UUID(gate['gate_id']): CameraRelay(
@@ -29,29 +83,54 @@ def setup_configuration(on_event: Callable):
     #     ) for gate in gates_data
     # }
 
-    stream_to_gate_data = fetch_data("stream-to-gate-mapping/")
-    logging.info(f'stream_to_gate mapping: {stream_to_gate_data}')
-    stream_to_gate: Dict[UUID, UUID] = {
-        UUID(item['camera_id']): UUID(item['gate_id']) for item in stream_to_gate_data if item
-    }
+    stream_to_gate = fetch_stream_to_gate()
 
-    streams_data = fetch_data("streams/")
-    streams: Dict[UUID, Stream] = {
-        UUID(stream['camera_id']): Stream(
-            uuid=stream['camera_id'],
-            ip=stream['stream_ip'],
-            port=stream['stream_port'],
-            link=stream['stream_path'],
-            user=stream['username'],
-            password=stream['password'],
-        ) for stream in streams_data
-    }
+    cameras = fetch_cameras()
+    if shard is not None:
+        cameras = shard.assign(cameras)
+        logging.info(f'Shard {shard.node_id}: {len(cameras)} camera(s) of {len(shard.nodes)} node(s).')
 
-    detectors: Dict[UUID, Detector] = {
-        UUID(stream['camera_id']): Detector(UUID(stream['camera_id']), on_event)
-        for stream in streams_data
-    }
+    # return gates, stream_to_gate, cameras
+    return stream_to_gate, cameras
+
+class ConfigWatcher:
+    # polls the ACS camera list version and the shard membership off the scheduler thread,
+    # a changed configuration is handed to on_change and applied by the scheduler between its passes
+    POLL_INTERVAL = config['acs']['poll_interval']
+
+    def __init__(self, version: str, on_change: Callable, shard: Optional[ShardMembership] = None):
+        self._version = version
+        self._on_change = on_change
+        self._shard = shard
+        self._interval = min(self.POLL_INTERVAL, shard.HEARTBEAT) if shard is not None else self.POLL_INTERVAL
+
+        thread = Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self) -> None:
+        polled_at = time.monotonic()
+        while True:
+            time.sleep(self._interval)
+            # a node has joined or died: the consistent hash moves only the cameras of the changed ring arcs
+            membership_changed = self._shard is not None and self._shard.refresh()
 
-    # return gates, stream_to_gate, streams, detectors
-    return stream_to_gate, streams, detectors
+            version = self._version
+            if time.monotonic() - polled_at >= self.POLL_INTERVAL:
+                polled_at = time.monotonic()
+                try:
+                    version = fetch_version()
+                except Exception as e:
+                    logging.warning(f'Camera list version check failed: {e}')
+            if version == self._version and not membership_changed:
+                continue
 
+            try:
+                configuration = fetch_configuration(self._shard)
+            except Exception as e:
+                logging.warning(f'Configuration reload postponed, fetch failed: {e}')
+                if membership_changed:
+                    self._shard.nodes = frozenset()  # retried on the next check
+                continue
+            self._version = version
+            self._on_change(*configuration)
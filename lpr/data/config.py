@@ -1,25 +1,53 @@
 _models = {
     'plate': {
         'model_path': './data/weights/plate_n_001_openvino_model/plate_n_001.xml',
+        'int8_model_path': './data/weights/plate_n_001_openvino_model/plate_n_001_int8.xml',
+        'precision': 'fp32',  # 'fp32' or 'int8' (see tools/quantize.py)
         'image_size': (640, 640),
         'number_classes': 6,
         'stride': 32,
+        'batch_size': 1,  # > 1 enables cross-stream batching
+        'batch_timeout': 0.02,  # seconds to wait for a batch to fill up
+        'roi_mode': 'fit',  # 'fit' - roi is scaled up to image_size, 'shrink' - roi keeps the full frame scale
+        'embedded_preprocessing': True,  # layout change and scaling run inside the OpenVINO graph
     },
     'char': {
         'model_path': './data/weights/char_openvino_model/char.xml',
+        'int8_model_path': './data/weights/char_openvino_model/char_int8.xml',
+        'precision': 'fp32',
         'image_size': (320, 320),
         'number_classes': 23,
         'stride': 32,
+        'embedded_preprocessing': True,
     },
 }
 
+_openvino = {
+    'cache_dir': './data/model_cache',  # compiled models are reused across restarts, '' - compile on every start
+}
+
+_postprocess = {
+    'backend': 'numpy',  # 'numpy' or 'torch' (needs requirements-torch.txt installed)
+    'max_masks': 3,  # masks/contours are decoded only for that many most confident plates (vehicles tracked)
+}
+
 _detector = {
     'starving_delay': 0.5,
     'outdated_delay': 7,
     'conf_threshold': 35,
     'count_threshold': 5,
-    'jump_threshold': 0.40,
-    'recognition_borders': {
+    # 'count' - string votes over the thresholds above, 'consensus' - char level fusion,
+    # 'sequential' - sequential probability test on the leading string, the count rule for ambiguous reads
+    'decision': 'count',
+    'consensus_margin': 1.5,  # summed confidence every char position must lead its runner-up by
+    'consensus_min_length': 7,  # chars of the shortest plate format, shorter reads are not fused
+    'sequential_misread': 0.05,  # chance of another plate read as exactly the leading string
+    'sequential_error_rate': 0.01,  # accepted chance of a wrong sequential decision
+    'snapshot_width': 640,  # event image fallback kept for a plate frame once its full image is released
+    'frame_budget': 4 * 2 ** 20,  # bytes of plate crops and snapshots kept per camera
+    'char_deadline': 1.5,  # seconds after the plate request a crop is still worth a char inference
+    'char_candidates': 3,  # newest crops of a track the best one is picked from
+    'recognition_borders': {  # default roi, relative to the frame size
         'x_min': 0.3,
         'x_max': 1,
         'y_min': 0,
@@ -27,17 +55,103 @@ _detector = {
     }
 }
 
+_quality = {
+    'min_quality': 0.1,  # plate crops below that score are tracked but get no char inference
+    'full_height': 24,  # plate box height in pixels that scores as full size
+    'full_sharpness': 100.,  # variance of the crop laplacian that scores as fully sharp
+    'aspect_single': 4.6,  # corner width / height of a single line plate
+    'aspect_double': 1.7,  # and of a two line plate
+}
+
+_rectification = {
+    # fixed cameras reuse the plate corner shape learned for a spot of the frame, off until evaluated on our cameras
+    'enabled': False,
+    'grid': 8,  # frame cells per side a corner shape is learned for
+    'samples': 20,  # solved plates before a cell shape is used
+    'tolerance': 0.05,  # mean deviation of the solved corners, relative to the box height, to trust a cell
+    'verify_every': 20,  # plates of a trusted cell solved anyway, so the shape follows a moved camera
+}
+
+_tracking = {
+    'min_iou': 0.2,  # overlap of a plate with the motion predicted box of a track to continue it
+    'max_distance': 1.5,  # or center distance, in plate sizes, for plates that moved further
+    'max_age': 2,  # seconds without a matching plate after which a track and its votes are dropped
+    'smoothing': 0.5,  # running average weight of a new velocity sample
+    'timeline': 20,  # plate frames voting per track
+}
+
+_stream = {
+    'capture_mode': 'grab',  # 'read' - decode every frame, 'grab' - decode only frames requested by the scheduler
+    'target_fps': 0,  # decode at least that often in 'grab' mode, 0 - on request only
+    'ring_size': 8,  # preallocated frame slots per camera: frames in inference, the event frame, the latest frame
+    'capture_workers': 0,  # capture processes: 0 - threads in the lpr process, -1 - one per 4 cores, N - N processes
+}
+
+_motion = {
+    'enabled': True,
+    'width': 160,  # frames are downscaled to that width before differencing
+    'pixel_threshold': 25,  # gray level difference of a changed pixel
+    'sensitivity': 0.005,  # share of changed pixels to consider the scene moving
+    'background_rate': 0.05,  # running average weight of the background model
+    'keepalive': 5,  # seconds, infer anyway after that long without inference
+    'check_fps': 5,  # frames per second of a static scene decoded and checked for motion
+}
+
+_scheduler = {
+    'idle_timeout': 1.,  # seconds to sleep without any frame or inference signal
+    'busy_timeout': 0.005,  # seconds to sleep while work waits for a free inference request
+    'default_weight': 1.,  # share of plate inference of a camera without ACS inference_weight
+    'default_fps': 0,  # plate inference frame rate limit of a camera without ACS inference_fps, 0 - unlimited
+    'max_frame_age': 0.5,  # seconds, older frames are dropped instead of being inferred late
+    'decode_lead': 0.1,  # seconds before a camera may be dispatched again its next frame is requested (grab mode)
+}
+
+_overload = {
+    'enabled': True,
+    'high_delay': 0.25,  # seconds of smoothed queueing delay (decode or crop to dispatch) to step load shedding up
+    'low_delay': 0.1,  # seconds to step it back down
+    'dwell': 2,  # seconds between steps
+    'smoothing': 0.1,  # running average weight of a new delay sample
+    'occupied_fps': 5,  # level 1: plate inference frame rate of occupied cameras
+    'min_quality': 0.4,  # level 2: plate crops below that quality score skip char inference
+    'idle_fps': 1,  # level 3: plate inference frame rate of idle cameras
+}
+
+_stats = {
+    'log_interval': 60,  # seconds
+}
+
+_sharding = {
+    'enabled': False,  # cameras are split between the lpr nodes registered in redis
+    'redis_url': 'redis://redis:6379/1',
+    'heartbeat': 2,  # seconds between node registrations and membership checks
+    'ttl': 6,  # seconds without a heartbeat after which a node is considered dead
+    'replicas': 64,  # points of every node on the consistent hash ring
+}
+
 _event = {
     'duplicate_delay': 20,
 }
 
 _acs = {
     'base_url': 'http://acs:8000/api',
+    'poll_interval': 10,  # seconds between camera list version checks, changed cameras are reloaded at runtime
 }
 
 config = {
     'models': _models,
+    'openvino': _openvino,
+    'postprocess': _postprocess,
     'detector': _detector,
+    'tracking': _tracking,
+    'quality': _quality,
+    'rectification': _rectification,
+    'stream': _stream,
+    'motion': _motion,
+    'scheduler': _scheduler,
+    'overload': _overload,
+    'stats': _stats,
+    'sharding': _sharding,
     'event': _event,
     'acs': _acs,
 }
@@ -0,0 +1,46 @@
+import time
+from threading import Lock
+
+
+class TimedLock:
+    # threading.Lock that accounts the time spent waiting for it, stats() reads and resets the window
+    def __init__(self):
+        self._lock = Lock()
+        # updated by the thread that has just acquired the lock, so the lock guards them too
+        self._acquisitions = 0
+        self._wait_sum = 0.
+        self._wait_max = 0.
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started_at = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            wait = time.perf_counter() - started_at
+            self._acquisitions += 1
+            self._wait_sum += wait
+            self._wait_max = max(self._wait_max, wait)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def stats(self) -> dict:
+        # acquisitions and wait time since the previous call
+        with self._lock:
+            stats = {
+                'acquisitions': self._acquisitions,
+                'wait_avg_ms': self._wait_sum / self._acquisitions * 1000 if self._acquisitions else 0.,
+                'wait_max_ms': self._wait_max * 1000,
+            }
+            self._acquisitions, self._wait_sum, self._wait_max = 0, 0., 0.
+        return stats
@@ -1,3 +1,6 @@
+import time
+STARTED_AT = time.monotonic()  # before the heavy imports, so they are part of the startup log
+
 import base64
 import logging
 import requests
@@ -5,65 +8,162 @@ import pytz
 import cv2
 from collections import deque
 from datetime import datetime, timedelta
+from functools import partial
 from threading import Lock
 from uuid import UUID, uuid4
-from typing import Dict, Deque
+from typing import Dict, Deque, Optional
 from data.config import config
-from io import BytesIO
-from PIL import Image
 from predictors.detector import Detector
-from stream.streams import Stream
+from stream.streams import FrameSource
+from stream.workers import CaptureWorkers, worker_count
 from predictors.base import QueuedPredictor
+from scheduler.fair import FairScheduler
+from scheduler.overload import OverloadController
+from scheduler.wakeup import Wakeup
 
-from config_setup import setup_configuration
+from config_setup import ConfigWatcher, fetch_configuration, fetch_version, open_streams, build_detectors
+from sharding import ShardMembership
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 API_BASE_URL = config['acs']['base_url']
+IDLE_TIMEOUT = config['scheduler']['idle_timeout']
+BUSY_TIMEOUT = config['scheduler']['busy_timeout']
+MAX_FRAME_AGE = config['scheduler']['max_frame_age']
+DECODE_LEAD = config['scheduler']['decode_lead']
+MOTION_CHECK_FPS = config['motion']['check_fps']
+SHARDING_ENABLED = config['sharding']['enabled']
 
 class LPRSystem:
     def __init__(self):
         self.streams_last_relay_lock = Lock()
-        self.streams_last_event: Dict[UUID, Dict] = {}
+        self.streams_last_event: Dict[UUID, Dict[str, datetime]] = {}  # recognition -> its last new event
         # self.gates: Dict[UUID, CameraRelay] = {}
         self.stream_to_gate: Dict[UUID, UUID] = {}
-        self.streams: Dict[UUID, Stream] = {}
+        self.cameras: Dict[UUID, dict] = {}  # ACS settings the running streams and detectors were built from
+        self.streams: Dict[UUID, FrameSource] = {}
         self.detectors: Dict[UUID, Detector] = {}
         self.plate_infer_queue: QueuedPredictor = None
         self.char_infer_queue: QueuedPredictor = None
-        self.plate_balancing_queue: Deque[UUID] = deque(maxlen=100)
+        self.plate_scheduler = FairScheduler()
+        self.overload = OverloadController()
         self.char_balancing_queue: Deque[UUID] = deque(maxlen=100)
+        self.wakeup = Wakeup()
+        self.capture_workers: Optional[CaptureWorkers] = None
+        self.shard: Optional[ShardMembership] = None
+        self.config_watcher: Optional[ConfigWatcher] = None
+        self._pending_configuration = None  # set by the config watcher thread, applied by the scheduler
+        self._stats_logged_at = time.monotonic()
+        self._request_wait: Optional[float] = None  # seconds until the next camera needs a frame requested
+        self._startup_phases: Dict[str, float] = {'imports': time.monotonic() - STARTED_AT}
+        self._setup_done_at = 0.
+        self._first_frame_logged = False
+
+    def _startup_phase(self, name: str, started_at: float) -> float:
+        now = time.monotonic()
+        self._startup_phases[name] = now - started_at
+        return now
 
     def setup(self):
+        started_at = time.monotonic()
         # Fetch configuration from Django microservice
         # self.gates, self.stream_to_gate, self.streams, self.detectors = setup_configuration(self.on_event)
-        self.stream_to_gate, self.streams, self.detectors = setup_configuration(self.on_event)
-
-        # Initialize streams_last_event
-        self.streams_last_event = {
-            stream_id: {
-                'recognition': '',
-                'datetime': datetime.utcnow(),
-            } for stream_id, stream in self.streams.items()
-        }
+        if worker_count():
+            self.capture_workers = CaptureWorkers(worker_count(), on_frame=partial(self.wakeup.notify, 'frame'))
+        if SHARDING_ENABLED:
+            self.shard = ShardMembership()
+        # the version goes first, so a change made during the fetch is picked up by the first poll
+        version = fetch_version()
+        self.reconcile(*fetch_configuration(self.shard))
+        self.config_watcher = ConfigWatcher(version, self.on_configuration_change, self.shard)
+        started_at = self._startup_phase('config fetch', started_at)
 
         # Setup inference queues
         self.plate_infer_queue = QueuedPredictor(callback=self.on_plates_detection, **config['models']['plate'])
+        started_at = self._startup_phase('plate model compile', started_at)
         self.char_infer_queue = QueuedPredictor(callback=self.on_chars_detection, **config['models']['char'])
+        self._setup_done_at = self._startup_phase('char model compile', started_at)
+        phases = ', '.join(f'{name}: {duration:.2f}s' for name, duration in self._startup_phases.items())
+        logging.info(f'Startup - {phases}')
+
+    def add_cameras(self, cameras: Dict[UUID, dict]):
+        streams = open_streams(cameras, partial(self.wakeup.notify, 'frame'), self.capture_workers)
+        detectors = build_detectors(cameras)
+        for stream_uuid, detector in detectors.items():
+            self.plate_scheduler.add(stream_uuid, detector.inference_weight, detector.inference_fps)
+            self.streams_last_event[stream_uuid] = {}
+        self.detectors.update(detectors)
+        self.streams.update(streams)
+        self.cameras.update(cameras)
+
+    def remove_cameras(self, stream_uuids):
+        # runs on the scheduler thread, inference callbacks of removed cameras find no detector and are ignored
+        stream_uuids = set(stream_uuids)
+        if self.capture_workers is not None:
+            self.capture_workers.close_streams(stream_uuids)
+        for stream_uuid in stream_uuids:
+            stream = self.streams.pop(stream_uuid)
+            if self.capture_workers is None:
+                stream.close()
+            detector = self.detectors.pop(stream_uuid)
+            with detector.lock:
+                detector.close()
+            self.plate_scheduler.remove(stream_uuid)
+            self.streams_last_event.pop(stream_uuid, None)
+            self.cameras.pop(stream_uuid, None)
+        self.char_balancing_queue = deque(
+            (stream_uuid for stream_uuid in self.char_balancing_queue if stream_uuid not in stream_uuids),
+            maxlen=self.char_balancing_queue.maxlen,
+        )
+
+    def reconcile(self, stream_to_gate: Dict[UUID, UUID], cameras: Dict[UUID, dict]):
+        # only cameras whose ACS settings differ are restarted, the models and the other streams keep running
+        started_at = time.monotonic()
+        self.stream_to_gate = stream_to_gate
+        changed = {
+            stream_uuid for stream_uuid in cameras.keys() & self.cameras.keys()
+            if cameras[stream_uuid] != self.cameras[stream_uuid]
+        }
+        removed = self.cameras.keys() - cameras.keys()
+        added = cameras.keys() - self.cameras.keys()
+        if removed or changed:
+            self.remove_cameras(removed | changed)
+        if added or changed:
+            self.add_cameras({stream_uuid: cameras[stream_uuid] for stream_uuid in added | changed})
+        if removed or added or changed:
+            logging.info(f'Cameras reconciled in {(time.monotonic() - started_at) * 1000:.0f} ms - '
+                         f'added: {len(added)}, removed: {len(removed)}, changed: {len(changed)}, '
+                         f'running: {len(self.streams)}')
+
+    def on_configuration_change(self, stream_to_gate: Dict[UUID, UUID], cameras: Dict[UUID, dict]):
+        # config watcher thread, the scheduler owns streams and detectors
+        self._pending_configuration = stream_to_gate, cameras
+        self.wakeup.notify('config')
+
+    def log_first_frame(self):
+        self._first_frame_logged = True
+        now = time.monotonic()
+        logging.info(f'Startup - first frame: {now - self._setup_done_at:.2f}s, total: {now - STARTED_AT:.2f}s')
 
     def on_event(self, event_data: dict):
         _stream_uuid = event_data['stream_uuid']
-        last_recognition = self.streams_last_event[_stream_uuid]
-        is_different = event_data['recognition'] != last_recognition['recognition']
-        time_delta = event_data['datetime'] - last_recognition['datetime']
+        # several vehicles are tracked per camera, so every recognition is deduplicated on its own
+        last_events = self.streams_last_event.get(_stream_uuid)
+        if last_events is None:
+            # camera removed after its event was decided
+            if event_data['frame_ref'] is not None:
+                event_data['frame_ref'].release()
+            return
+        last_datetime = last_events.get(event_data['recognition'])
+        duplicate_delay = config['event']['duplicate_delay']
 
-        if is_different or time_delta.seconds > config['event']['duplicate_delay']:
+        if last_datetime is None or (event_data['datetime'] - last_datetime).seconds > duplicate_delay:
             with self.streams_last_relay_lock:
-                self.streams_last_event[_stream_uuid].update({
-                    'recognition': event_data['recognition'],
-                    'datetime': event_data['datetime'],
-                })
+                for recognition, recognition_datetime in list(last_events.items()):
+                    if (event_data['datetime'] - recognition_datetime).seconds > duplicate_delay:
+                        del last_events[recognition]
+                last_events[event_data['recognition']] = event_data['datetime']
             is_new_event = True
         else:
             is_new_event = False
@@ -72,16 +172,18 @@ class LPRSystem:
         moscow_timezone = pytz.timezone('Europe/Moscow')
         moscow_datetime = utc_datetime.astimezone(moscow_timezone)
 
-        if is_new_event:
-            frame = event_data['frame']
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(frame_rgb)
-            buffered = BytesIO()
-            image.save(buffered, format="JPEG", quality=50)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            image_data = f"data:image/jpeg;base64,{img_str}"
-        else:
-            image_data = None
+        try:
+            if is_new_event and event_data['frame'] is not None:
+                frame = event_data['frame']
+                _, buffered = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
+                img_str = base64.b64encode(buffered.tobytes()).decode()
+                image_data = f"data:image/jpeg;base64,{img_str}"
+            else:
+                image_data = None
+        finally:
+            # the ring slot of the event frame is free again once encoded
+            if event_data['frame_ref'] is not None:
+                event_data['frame_ref'].release()
 
         lpr_event_data = {
             'camera_id': str(_stream_uuid),
@@ -124,30 +226,124 @@ class LPRSystem:
         _stream_uuid = result['userdata']['stream_uuid']
         _frame_uuid = result['userdata']['frame_uuid']
 
-        with self.detectors[_stream_uuid].lock:
-            self.detectors[_stream_uuid].on_plates_detection(result, _frame_uuid)
+        if not self._first_frame_logged:
+            self.log_first_frame()
+
+        detector = self.detectors.get(_stream_uuid)
+        if detector is None:
+            return  # camera removed while inferred
+        # plate geometry and warps run without the lock, only taking and publishing the frame hold it
+        with detector.lock:
+            frame = detector.take_requested(_frame_uuid)
+        if frame is None:
+            self.wakeup.notify('plate_done')
+            return
+        plates = frame.on_plates_detection(result, detector.rectifier)
+        with detector.lock:
+            detector.on_plates_detection(frame, plates)
+            has_crops = detector.has_awaiting_recognition
+        self.wakeup.notify('crop_ready' if has_crops else 'plate_done')
 
     def on_chars_detection(self, result):
         _stream_uuid = result['userdata']['stream_uuid']
         _frame_uuid = result['userdata']['frame_uuid']
 
-        with self.detectors[_stream_uuid].lock:
-            self.detectors[_stream_uuid].on_chars_detection(result, _frame_uuid)
+        detector = self.detectors.get(_stream_uuid)
+        if detector is None:
+            return  # camera removed while inferred
+        with detector.lock:
+            frame = detector.frames.get(_frame_uuid)
+        # crops are not changed once published, the chars are analyzed without the lock
+        recognition = frame.read_chars(result) if frame is not None else None
+        with detector.lock:
+            event_data = detector.on_chars_detection(_frame_uuid, recognition)
+        # the image encode and the ACS post hold no detector lock
+        if event_data is not None:
+            self.on_event(event_data)
+        self.wakeup.notify('char_done')
+
+    def log_stats(self):
+        scheduler_stats = self.plate_scheduler.stats()
+        for stream_uuid, stream in self.streams.items():
+            counters = stream.counters
+            inference = scheduler_stats[stream_uuid]
+            detector = self.detectors[stream_uuid]
+            with detector.lock:
+                char_queue_age = detector.awaiting_age
+            lock = detector.lock.stats()
+            logging.info(f'Stream# {stream_uuid} - grabbed: {counters["grabbed"]}, '
+                         f'decoded: {counters["decoded"]}, consumed: {counters["consumed"]}, '
+                         f'overwritten: {counters["overwritten"]}, '
+                         f'inferred fps: {inference["fps"]:.1f}, '
+                         f'queueing delay avg/max: {inference["delay_avg_ms"]:.0f}/{inference["delay_max_ms"]:.0f} ms, '
+                         f'char queue age: {char_queue_age * 1000:.0f} ms, '
+                         f'detector lock wait avg/max: {lock["wait_avg_ms"]:.2f}/{lock["wait_max_ms"]:.2f} ms '
+                         f'of {lock["acquisitions"]}, '
+                         f'drops: {dict(detector.drops)}')
+        logging.info(f'Scheduler wakeups: {dict(self.wakeup.counters)}, overload level: {self.overload.level}, '
+                     f'queueing delay: {self.overload.delay * 1000:.0f} ms')
+        self._stats_logged_at = time.monotonic()
 
     def run(self):
         while True:
+            self.apply_overload()
             self.process_char_queue()
+            self.request_frames()
             self.process_plate_queue()
+            self.plate_infer_queue.flush()
+            if time.monotonic() - self._stats_logged_at > config['stats']['log_interval']:
+                self.log_stats()
+            if self._pending_configuration is not None:
+                configuration, self._pending_configuration = self._pending_configuration, None
+                self.reconcile(*configuration)
+            self.wakeup.wait(self._wait_timeout())
+
+    def apply_overload(self):
+        # oldest waiting work: crops in the char queues and frames of cameras that are due but not dispatched
+        backlog, occupied = 0., {}
+        for stream_uuid, detector in self.detectors.items():
+            with detector.lock:
+                occupied[stream_uuid] = detector.is_occupied
+                is_high_priority = detector.is_high_priority
+                backlog = max(backlog, detector.awaiting_age)
+            frame_age = self.streams[stream_uuid].frame_age
+            if is_high_priority and frame_age is not None and not self.plate_scheduler.time_to_eligible([stream_uuid]):
+                backlog = max(backlog, frame_age)
+        self.overload.update(backlog)
+        for stream_uuid, is_occupied in occupied.items():
+            reason, fps = self.overload.plate_limit(is_occupied)
+            self.plate_scheduler.limit(stream_uuid, fps, reason)
+
+    def _wait_timeout(self) -> float:
+        if self.char_balancing_queue and self.char_infer_queue.is_ready:
+            return 0.
+        # a request is returned to the pool only after its callback has signalled, so work left behind
+        # a busy queue is retried shortly instead of waiting for the next signal
+        if self.char_balancing_queue or self.plate_infer_queue.has_pending:
+            return BUSY_TIMEOUT
+        candidates = self._plate_candidates()
+        timeout = IDLE_TIMEOUT if self._request_wait is None else min(self._request_wait, IDLE_TIMEOUT)
+        if not candidates:
+            return timeout
+        if not self.plate_infer_queue.is_ready:
+            return BUSY_TIMEOUT
+        # only rate limited cameras are left
+        return min(self.plate_scheduler.time_to_eligible(candidates), timeout)
 
     def process_char_queue(self):
         while self.char_balancing_queue and self.char_infer_queue.is_ready:
             stream_uuid = self.char_balancing_queue.popleft()
             detector = self.detectors[stream_uuid]
             with detector.lock:
-                frame_uuid = detector.frames_awaiting_recognition.popleft()
-                if frame_uuid not in detector.frames:
+                frame_uuid = detector.pop_awaiting_recognition()
+                if frame_uuid is None or frame_uuid not in detector.frames:
+                    continue
+                frame = detector.frames[frame_uuid]
+                if self.overload.skips_char_inference(frame.plate_detection.quality):
+                    detector.drops['overload_low_quality'] += 1
                     continue
-                cropped = detector.frames[frame_uuid].cropped
+                self.overload.observe(time.time() - frame.queued_at)
+                cropped = frame.cropped
             data = {
                 'stream_uuid': stream_uuid,
                 'frame_uuid': frame_uuid,
@@ -157,31 +353,76 @@ class LPRSystem:
         if not self.char_balancing_queue:
             for stream_uuid, detector in self.detectors.items():
                 with detector.lock:
-                    if detector.frames_awaiting_recognition:
+                    if detector.has_awaiting_recognition:
                         self.char_balancing_queue.append(stream_uuid)
 
+    def request_frames(self):
+        # a frame is requested only once its camera is about to be dispatched: a frame decoded right after the
+        # previous pop would age in the stream through a rate limit interval and be dropped as stale, so a rate
+        # limited camera would pay two decodes per inference
+        self._request_wait = None
+        for stream_uuid, stream in self.streams.items():
+            detector = self.detectors[stream_uuid]
+            with detector.lock:
+                is_high_priority = detector.is_high_priority
+            if not is_high_priority:
+                continue
+            wait = self.plate_scheduler.time_to_eligible([stream_uuid])
+            if wait > DECODE_LEAD:
+                lead = wait - DECODE_LEAD
+                self._request_wait = lead if self._request_wait is None else min(self._request_wait, lead)
+                continue
+            frame_age = stream.frame_age
+            # a pending frame that is still fresh at dispatch does not need a successor
+            if frame_age is None or frame_age + wait > MAX_FRAME_AGE:
+                stream.request_frame()
+
+    def _plate_candidates(self) -> list[UUID]:
+        candidates = []
+        for stream_uuid, detector in self.detectors.items():
+            with detector.lock:
+                is_high_priority = detector.is_high_priority
+            if is_high_priority and self.streams[stream_uuid].is_pending:
+                candidates.append(stream_uuid)
+        return candidates
+
     def process_plate_queue(self):
-        while self.plate_balancing_queue and self.plate_infer_queue.is_ready:
-            stream_uuid = self.plate_balancing_queue.popleft()
+        while self.plate_infer_queue.is_ready:
+            stream_uuid = self.plate_scheduler.select(self._plate_candidates())
+            if stream_uuid is None:
+                return
             stream = self.streams[stream_uuid]
             with stream.frame_lock:
+                frame_age = stream.frame_age
                 frame = stream.pop_frame()
-            if frame is not None:
-                frame_uuid = uuid4()
-                data = {
-                    'stream_uuid': stream_uuid,
-                    'frame_uuid': frame_uuid,
-                }
-                detector = self.detectors[stream_uuid]
-                with detector.lock:
-                    detector.on_plates_detection_requested(frame_uuid, frame.copy())
-                self.plate_infer_queue.add_frame(frame, userdata=data)
+            if frame is None:
+                continue
 
-        if not self.plate_balancing_queue:
-            for stream_uuid, detector in self.detectors.items():
-                with detector.lock:
-                    if detector.is_high_priority:
-                        self.plate_balancing_queue.append(stream_uuid)
+            detector = self.detectors[stream_uuid]
+            if frame_age > MAX_FRAME_AGE:
+                # a frame held back by overload limits is counted under the limit reason
+                reason = self.plate_scheduler.shares[stream_uuid].limit_reason
+                detector.drops[reason or 'stale_frame'] += 1
+                if reason is None:
+                    self.overload.observe(frame_age)  # aged waiting for the plate queue, not for a limit
+                frame.release()
+                continue
+            if not detector.is_frame_relevant(frame.image):
+                # the static camera is not dispatched, but its next frame is not decoded and checked sooner either
+                self.plate_scheduler.hold(stream_uuid, 1 / MOTION_CHECK_FPS)
+                frame.release()
+                continue
+            frame_uuid = uuid4()
+            data = {
+                'stream_uuid': stream_uuid,
+                'frame_uuid': frame_uuid,
+            }
+            # the detector keeps the ring slot pinned, the predictor letterboxes a copy before add_frame returns
+            with detector.lock:
+                detector.on_plates_detection_requested(frame_uuid, frame)
+            self.plate_infer_queue.add_frame(frame.image, userdata=data, roi=detector.roi)
+            self.plate_scheduler.dispatched(stream_uuid, frame_age)
+            self.overload.observe(frame_age)
 
 
 if __name__ == '__main__':
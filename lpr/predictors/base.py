@@ -1,14 +1,20 @@
+import time
 from functools import partial
+from threading import Lock
+from typing import Optional
 
 import cv2
 import numpy as np
 import openvino as ov
 from openvino import properties
+from openvino.preprocess import PrePostProcessor
 
-from predictors.utils import letterbox_image, image_to_tensor, postprocess
+from data.config import config
+from predictors.utils import letterbox_image, image_to_tensor, postprocess, crop_roi, shift_predictions
 
 
 class QueuedPredictor:
+    CACHE_DIR = config['openvino']['cache_dir']
 
     _core = ov.Core()
 
@@ -19,12 +25,44 @@ class QueuedPredictor:
             image_size: tuple[int, int],
             number_classes,
             stride=32,
+            batch_size=1,
+            batch_timeout=0.02,
+            roi_mode='fit',
+            embedded_preprocessing=True,
+            precision='fp32',
+            int8_model_path=None,
     ):
+        # OpenVINO keys the cached blobs on the model hash, device and compile config,
+        # so a changed model, precision or hint compiles anew and is cached next to the old one
+        if self.CACHE_DIR:
+            self._core.set_property({properties.cache_dir(): self.CACHE_DIR})
+
+        # 'int8' loads the post-training quantized IR made by tools/quantize.py
+        if precision == 'int8':
+            model_path = int8_model_path
         model = self._core.read_model(model_path)
 
         self._image_size = image_size
         self._stride = stride
         self._number_classes = number_classes
+        # 'fit' - roi is scaled up to image_size, 'shrink' - roi keeps the full frame scale (smaller input)
+        self._roi_mode = roi_mode
+
+        # frames of several streams are collected into one request, the model gets a fixed batch shape
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._pending: list[tuple[np.ndarray, dict]] = []
+        self._pending_since = 0.
+        self._pending_lock = Lock()
+        if self._batch_size > 1:
+            tw, th = image_size
+            model.reshape([self._batch_size, 3, th, tw])
+
+        # u8 NHWC frames go to the runtime as they are, layout change and scaling are part of the compiled graph
+        self._embedded_preprocessing = embedded_preprocessing
+        if self._embedded_preprocessing:
+            model = self._build_preprocessing(model)
+
         self._config = {
             properties.hint.performance_mode(): properties.hint.PerformanceMode.CUMULATIVE_THROUGHPUT,
             properties.hint.allow_auto_batching(): True,
@@ -39,10 +77,27 @@ class QueuedPredictor:
         bounded_callback = partial(self._callback)
         self._queue.set_callback(bounded_callback)
 
+    @staticmethod
+    def _build_preprocessing(model: ov.Model) -> ov.Model:
+        # letterbox resize stays in cv2: PrePostProcessor resize stretches to the model size and can not pad
+        ppp = PrePostProcessor(model)
+        ppp.input().tensor().set_element_type(ov.Type.u8).set_layout(ov.Layout('NHWC'))
+        ppp.input().model().set_layout(ov.Layout('NCHW'))
+        ppp.input().preprocess().convert_element_type(ov.Type.f32).scale(255.)
+        return ppp.build()
+
     @property
     def is_ready(self):
         return self._queue.is_ready()
 
+    @property
+    def is_batching(self) -> bool:
+        return self._batch_size > 1
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
     def __enter__(self):
         return self
 
@@ -50,29 +105,82 @@ class QueuedPredictor:
         self.wait_all()
 
     def _callback(self, request, userdata: dict):
-        det, seg = postprocess(
+        items = userdata['items']
+        predictions = postprocess(
             request,
-            original_shape=userdata['original_shape'],
+            input_hw=items[0]['input_hw'],
+            original_shapes=[item['original_shape'] for item in items],
             number_classes=userdata['number_classes'],
         )
-        result = {
-            'userdata': userdata['userdata'],
-            'det': det,
-            'seg': seg,
+        for item, (det, seg) in zip(items, predictions):
+            det, seg = shift_predictions(det, seg, item['offset'])
+            result = {
+                'userdata': item['userdata'],
+                'det': det,
+                'seg': seg,
+            }
+            self._user_callback(result)
+
+    def add_frame(self, frame: np.array, userdata: dict, roi: Optional[dict] = None) -> None:
+        target_size = self._image_size
+        offset = 0, 0
+        if roi is not None:
+            h, w = frame.shape[:2]
+            frame, offset = crop_roi(frame, roi)
+            if self._roi_mode == 'shrink' and not self.is_batching:
+                tw, th = self._image_size
+                scale = min(tw / w, th / h)
+                target_size = int(frame.shape[1] * scale), int(frame.shape[0] * scale)
+
+        resized_image = letterbox_image(frame, target_size, self._stride, auto=not self.is_batching)
+        if self._embedded_preprocessing:
+            input_tensor = resized_image[None]
+        else:
+            input_tensor = image_to_tensor(resized_image)
+        item = {
+            'userdata': userdata,
+            'input_hw': resized_image.shape[:2],
+            'original_shape': frame.shape,
+            'offset': offset,
         }
-        self._user_callback(result)
 
-    def add_frame(self, frame: np.array, userdata: dict) -> None:
-        resized_image = letterbox_image(frame, self._image_size, self._stride)
-        input_tensor = image_to_tensor(resized_image)
+        if not self.is_batching:
+            self._start([(input_tensor, item)])
+            return
+
+        with self._pending_lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((input_tensor, item))
+            if len(self._pending) < self._batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self._start(batch)
+
+    def flush(self, force: bool = False) -> None:
+        # partially filled batch is started once its deadline has passed
+        with self._pending_lock:
+            if not self._pending:
+                return
+            if not force and (time.monotonic() - self._pending_since < self._batch_timeout or not self.is_ready):
+                return
+            batch, self._pending = self._pending, []
+        self._start(batch)
+
+    def _start(self, batch: list[tuple[np.ndarray, dict]]) -> None:
+        tensors = [tensor for tensor, _ in batch]
+        if self.is_batching and len(tensors) < self._batch_size:
+            tensors.extend([np.zeros_like(tensors[0])] * (self._batch_size - len(tensors)))
+        input_tensor = np.concatenate(tensors) if len(tensors) > 1 else tensors[0]
+
         self._queue.start_async(
             {self._input_layer_name: input_tensor},
             userdata={
-                'userdata': userdata,
-                'original_shape': frame.shape,
+                'items': [item for _, item in batch],
                 'number_classes': self._number_classes,
             }
         )
 
     def wait_all(self):
+        self.flush(force=True)
         self._queue.wait_all()
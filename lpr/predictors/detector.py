@@ -2,14 +2,19 @@ from datetime import datetime
 import logging
 import time
 from typing import Optional
-from uuid import UUID
+from uuid import UUID, uuid4
 from collections import deque, Counter
-from threading import Lock
 
+import cv2
 import numpy as np
 
 from data.config import config
 from predictors.processor import PlatePredictions, PlatePrediction, CharDetections
+from predictors.rectify import PlateRectifier
+from predictors.tracking import PlateTracker, Track
+from stream.motion import MotionDetector
+from stream.ring import FrameRef
+from locks import TimedLock
 import logging
 
 
@@ -17,27 +22,69 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 
 class Frame:
-    def __init__(self, uuid: UUID, original_image: np.array, timestamp: float):
+    # one plate inference request, then one detected plate of it: the full frame stays pinned only until the
+    # plate detection, a detected plate keeps its warped crop, and the full image only while it is the camera's
+    # event frame
+    __slots__ = (
+        'uuid', 'image_ref', 'image_shape', 'timestamp', 'plate_detection', 'cropped', 'snapshot', 'downscaled',
+        'recognition',
+        'track_id', 'queued_at', 'is_not_empty', 'is_dropped',
+    )
+
+    SNAPSHOT_WIDTH = config['detector']['snapshot_width']
+
+    def __init__(self, uuid: UUID, image_ref: Optional[FrameRef], timestamp: float, image_shape: tuple = None):
         self.uuid: UUID = uuid
-        self.original_image = original_image
+        self.image_ref: Optional[FrameRef] = image_ref  # pinned stream ring slot, None once released
+        self.image_shape = image_shape or image_ref.image.shape
         self.timestamp = timestamp
-        self._plate_detections: Optional[PlatePredictions] = None
-        self.plate_detection: Optional[PlatePrediction] = None  # most conf only
+        self.plate_detection: Optional[PlatePrediction] = None
+        self.cropped: Optional[np.ndarray] = None
+        self.snapshot: Optional[np.ndarray] = None  # downscaled full frame, kept when the full image is released
+        self.downscaled: Optional[np.ndarray] = None  # snapshot made ahead, outside the detector lock
         self.recognition: Optional[CharDetections] = None
+        self.track_id: Optional[int] = None
+        self.queued_at: Optional[float] = None  # put in the char queue
 
         self.is_not_empty = False  # detection with 0 boxes received
         self.is_dropped = False  # for future implementation of postprocess filtering
 
     @property
-    def cropped(self):
-        return self.plate_detection.cropped
+    def original_image(self) -> Optional[np.ndarray]:
+        return self.image_ref.image if self.image_ref is not None else None
 
-    def on_plates_detection(self, result) -> None:
-        if len(result['det']) == 0:
+    @property
+    def nbytes(self) -> int:
+        # images kept outside the stream ring
+        return sum(image.nbytes for image in (self.cropped, self.snapshot) if image is not None)
+
+    def release(self) -> None:
+        if self.image_ref is not None:
+            self.image_ref.release()
+            self.image_ref = None
+
+    def downscale(self) -> None:
+        h, w = self.image_shape[:2]
+        scale = min(1., self.SNAPSHOT_WIDTH / w)
+        self.downscaled = cv2.resize(
+            self.original_image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+    def keep_snapshot(self) -> None:
+        # the full image goes back to the ring, its downscaled copy is kept for the event
+        if self.image_ref is None:
             return
+        self.snapshot, self.downscaled = self.downscaled, None
+        self.release()
+
+    def on_plates_detection(self, result, rectifier: Optional[PlateRectifier] = None) -> list['Frame']:
+        # the most confident plate stays with this frame, every other plate gets a frame of its own
+        # without the full image, all of them are cropped before the full image is let go.
+        # Runs outside the detector lock, the frame is owned by the caller until it is published
+        if len(result['det']) == 0:
+            self.release()
+            return []
         
-        _plate_detections = PlatePredictions(result, self.original_image)
-        _plate_detection = _plate_detections.plates[0]
+        _plate_detections = PlatePredictions(result, self.original_image, rectifier)
         
         # TODO: CUSTOM FILTER HARDCODE SUKAAA UBRAT!
         # if (_plate_detection.box[2] + _plate_detection.box[0]) / 2 < self.original_image.shape[1] * 0.25:
@@ -46,36 +93,69 @@ class Frame:
             
         # logging.info(f'Frame with box[3]={_plate_detection.box}')
         
-        self._plate_detections = _plate_detections
-        self.plate_detection = _plate_detection
-        
-        self.is_not_empty = True
+        plates = []
+        for _plate_detection in _plate_detections.plates:
+            plate = self if not plates else Frame(uuid4(), None, self.timestamp, self.image_shape)
+            plate.plate_detection = _plate_detection
+            plate.cropped = _plate_detection.cropped
+            _plate_detection.quality  # cached here, not under the detector lock
+            plate.is_not_empty = True
+            plates.append(plate)
+        _plate_detections.release_image()
+        if not plates:
+            self.release()
+        else:
+            self.downscale()  # the frame may become the event frame, its snapshot is ready before the lock
+        return plates
 
-    def on_chars_detection(self, result) -> None:
-        if len(result['det']) != 0:
-            self.recognition = CharDetections(result, self.cropped)
+    def read_chars(self, result) -> Optional[CharDetections]:
+        # runs outside the detector lock, the lazy char analysis included
+        if len(result['det']) == 0:
+            return None
+        recognition = CharDetections(result, self.cropped)
+        recognition.string, recognition.confs
+        return recognition
 
 
 class Detector:
     STARVING_DELAY = config['detector']['starving_delay']
     OUTDATED_DELAY = config['detector']['outdated_delay']
-    CONF_THRESHOLD = config['detector']['conf_threshold']
-    COUNT_THRESHOLD = config['detector']['count_threshold']
-    JUMP_THRESHOLD = config['detector']['jump_threshold']
+    MOTION_ENABLED = config['motion']['enabled']
+    MOTION_KEEPALIVE = config['motion']['keepalive']
+    FRAME_BUDGET = config['detector']['frame_budget']
+    RECTIFICATION_ENABLED = config['rectification']['enabled']
+    DECISION = config['detector']['decision']
+    MIN_QUALITY = config['quality']['min_quality']
+    CHAR_DEADLINE = config['detector']['char_deadline']
+    CHAR_CANDIDATES = config['detector']['char_candidates']
 
-    def __init__(self, uuid, event_callback):
+    def __init__(self, uuid, roi: Optional[dict] = None,
+                 motion_sensitivity: Optional[float] = None,
+                 inference_weight: Optional[float] = None, inference_fps: Optional[float] = None):
         self.uuid: UUID = uuid
+        self.roi = roi or config['detector']['recognition_borders']
+        # share of plate inference and its frame rate limit, None - scheduler defaults
+        self.inference_weight = inference_weight
+        self.inference_fps = inference_fps
         self._last_detection_timestamp = time.time()
-        self._last_detection_pos = 0, 0
+        self._last_request_timestamp = 0.
+        # requested frames waiting for plate detection, detected plates live in the timelines of their tracks
         self.frames: dict[UUID, Frame] = {}
-        self.frames_timeline: deque[UUID] = deque(maxlen=20)
-        self.frames_awaiting_recognition: deque[UUID] = deque(maxlen=20)
+        self.frames_requested: deque[UUID] = deque(maxlen=20)
+        self.frames_in_progress: set[UUID] = set()  # plate results being processed outside the lock
+        self.is_closed = False
+        self.tracker = PlateTracker(self.DECISION)
+        self.rectifier = PlateRectifier() if self.RECTIFICATION_ENABLED else None
+        self._served_track = -1  # tracks take turns for char inference
+        self._event_frame: Optional[Frame] = None  # latest detected plate frame, the only one keeping its full image
 
-        self.lock = Lock()
-        self.event_callback = event_callback
+        self.lock = TimedLock()
 
         self._is_occupied = False
 
+        self.motion = MotionDetector(self.roi, motion_sensitivity)
+        self.drops = Counter()
+
     @property
     def is_starving(self) -> bool:
         return time.time() - self._last_detection_timestamp > self.STARVING_DELAY
@@ -88,77 +168,200 @@ class Detector:
     def is_high_priority(self) -> bool:
         return self._is_occupied or self.is_starving
 
+    @property
+    def has_awaiting_recognition(self) -> bool:
+        return any(track.awaiting_recognition for track in self.tracker.tracks.values())
+
+    @property
+    def awaiting_age(self) -> float:
+        # seconds the oldest crop has been waiting in the char queue, 0 without crops
+        timestamps = [
+            self.frames[frame_uuid].queued_at
+            for track in self.tracker.tracks.values() for frame_uuid in track.awaiting_recognition
+            if frame_uuid in self.frames
+        ]
+        return time.time() - min(timestamps) if timestamps else 0.
+
+    def _drop_expired_crops(self) -> None:
+        # a crop past the deadline would decide on a scene that is gone, newer crops of the track replace it
+        now = time.time()
+        for track in self.tracker.tracks.values():
+            awaiting = track.awaiting_recognition
+            fresh = [
+                frame_uuid for frame_uuid in awaiting
+                if frame_uuid in self.frames and now - self.frames[frame_uuid].timestamp <= self.CHAR_DEADLINE
+            ]
+            if len(fresh) < len(awaiting):
+                self.drops['char_deadline'] += sum(frame_uuid in self.frames for frame_uuid in awaiting) - len(fresh)
+                track.awaiting_recognition = deque(fresh, maxlen=awaiting.maxlen)
+
+    def pop_awaiting_recognition(self) -> Optional[UUID]:
+        # round robin over the tracks, so a car that has just arrived is not queued behind the crops of
+        # a car standing at the barrier. Within a track the newest crops go first, the best of the
+        # char_candidates newest ones
+        self._drop_expired_crops()
+        waiting = [track_id for track_id, track in self.tracker.tracks.items() if track.awaiting_recognition]
+        if not waiting:
+            return None
+        track_id = min((track_id for track_id in waiting if track_id > self._served_track), default=min(waiting))
+        self._served_track = track_id
+        awaiting = self.tracker.tracks[track_id].awaiting_recognition
+        candidates = list(awaiting)[-self.CHAR_CANDIDATES:]
+        frame_uuid = max(reversed(candidates), key=self._crop_quality)  # a tie goes to the newer crop
+        awaiting.remove(frame_uuid)
+        return frame_uuid
+
+    def _crop_quality(self, frame_uuid: UUID) -> float:
+        frame = self.frames.get(frame_uuid)
+        return frame.plate_detection.quality if frame is not None else -1.  # dropped frames never win
+
+    def is_frame_relevant(self, frame: np.array) -> bool:
+        # static scene suppresses plate inference unless a plate was seen recently (car standing at the barrier),
+        # keepalive requests still re-check the scene from time to time
+        # (called by the scheduler only, the motion model is not shared with callback threads)
+        if not self.MOTION_ENABLED:
+            return True
+        is_moving = self.motion.update(frame)
+        now = time.time()
+        is_recent = now - self._last_detection_timestamp < self.MOTION_KEEPALIVE
+        if is_moving or self._is_occupied or is_recent or now - self._last_request_timestamp > self.MOTION_KEEPALIVE:
+            return True
+        self.drops['static_scene'] += 1
+        return False
+
     def _drop_outdated(self) -> None:
-        garbage = set(self.frames.keys()) - set(self.frames_timeline)
+        live = set(self.frames_requested) | self.frames_in_progress
+        for track in self.tracker.tracks.values():
+            live.update(track.timeline)
+        garbage = set(self.frames.keys()) - live
         for frame_uuid in garbage:
-            del self.frames[frame_uuid]
+            frame = self.frames.pop(frame_uuid)
+            frame.release()
+            track = self.tracker.tracks.get(frame.track_id)
+            if track is not None:
+                track.votes.remove(frame_uuid)
+        if self._event_frame is not None and self._event_frame.uuid in garbage:
+            self._event_frame = None
+
+    def _keep_event_frame(self, frame: Frame) -> None:
+        # results may come out of order, the newer of two frames stays the event frame
+        current = self._event_frame
+        if current is not None and current.timestamp > frame.timestamp:
+            frame.keep_snapshot()
+            return
+        if current is not None:
+            current.keep_snapshot()
+        self._event_frame = frame
 
-    def on_plates_detection_requested(self, uuid: UUID, original_image: np.array):
-        self.frames_timeline.append(uuid)
-        self.frames[uuid] = Frame(uuid, original_image, time.time())
+    def _enforce_budget(self) -> None:
+        # snapshots of the oldest frames go first, then the oldest frames themselves
+        total = sum(frame.nbytes for frame in self.frames.values())
+        for frame in self.frames.values():
+            if total <= self.FRAME_BUDGET:
+                return
+            if frame.snapshot is not None:
+                total -= frame.snapshot.nbytes
+                frame.snapshot = None
+        if total <= self.FRAME_BUDGET:
+            return
+        for frame in list(self.frames.values())[:-1]:
+            if total <= self.FRAME_BUDGET:
+                break
+            track = self.tracker.tracks.get(frame.track_id)
+            if track is not None and frame.uuid in track.timeline:
+                track.timeline.remove(frame.uuid)
+                total -= frame.nbytes
+                self.drops['frame_budget'] += 1
         self._drop_outdated()
 
-    def on_plates_detection(self, result: dict, uuid: UUID):
-        if uuid not in self.frames:
+    def _event_image(self) -> tuple[Optional[FrameRef], Optional[np.ndarray]]:
+        # the event is posted without the lock: the full image comes with a pin of its own, so its ring slot
+        # is not reused before the event is encoded, snapshots are never written again
+        if self._event_frame is not None and self._event_frame.image_ref is not None:
+            return self._event_frame.image_ref.pin(), None
+        for frame in reversed(self.frames.values()):
+            if frame.snapshot is not None:
+                return None, frame.snapshot
+        return None, None
+
+    def close(self) -> None:
+        # releases the ring slots of every kept frame, frames in progress are released when they come back
+        self.is_closed = True
+        self.frames_requested.clear()
+        self.tracker.tracks.clear()
+        self._drop_outdated()
+
+    def on_plates_detection_requested(self, uuid: UUID, image_ref: FrameRef):
+        self._last_request_timestamp = time.time()
+        self.frames_requested.append(uuid)
+        self.frames[uuid] = Frame(uuid, image_ref, self._last_request_timestamp)
+        self._drop_outdated()
+
+    def take_requested(self, uuid: UUID) -> Optional[Frame]:
+        # hands a requested frame to the plate result callback, it stays pinned until on_plates_detection
+        if uuid not in self.frames_requested:
             logging.info(f'Frame was cleaned (old or recognized event), detection ignored.'
                             f'id# {uuid}')
-            return
-        frame = self.frames[uuid]
-        frame.on_plates_detection(result)
+            return None
+        self.frames_requested.remove(uuid)
+        self.frames_in_progress.add(uuid)
+        return self.frames[uuid]
 
-        postprocess_filtered = False  # for future implementation as needed
+    def on_plates_detection(self, frame: Frame, plates: list[Frame]):
+        # publishes the plates Frame.on_plates_detection has cropped outside the lock
+        self.frames_in_progress.discard(frame.uuid)
+        if self.is_closed:
+            self.frames.pop(frame.uuid, None)
+            frame.release()
+            return
 
-        is_occupied = True
-        
-        
-        
-        if not frame.is_not_empty:
-            is_occupied = False
-        elif postprocess_filtered:
-            frame.is_dropped = True
-        else:
-            pos = frame.plate_detection.box[:2]
-            l_pos = self._last_detection_pos
-            relative_movement = ((pos[0]-l_pos[0])**2+(pos[1]-l_pos[1])**2)**0.5 / sum(frame.original_image.shape[:2])
-            if relative_movement > self.JUMP_THRESHOLD:
-                self.frames_timeline.clear()
-                logging.warning(f'New recognition is far away (by h) from the previous,'
-                             f' cleaning timeline.')
-            self.frames_awaiting_recognition.append(uuid)
+        # a vehicle not seen for tracking.max_age takes its votes and crops along
+        self.tracker.expire(time.time())
+        tracks = self.tracker.update([plate.plate_detection.box for plate in plates], frame.timestamp)
+        for plate, track in zip(plates, tracks):
+            plate.track_id = track.id
+            self.frames[plate.uuid] = plate
+            track.timeline.append(plate.uuid)
+            if plate.plate_detection.quality < self.MIN_QUALITY:
+                self.drops['low_quality'] += 1  # tracked, but not worth a char inference
+                continue
+            if len(track.awaiting_recognition) == track.awaiting_recognition.maxlen:
+                self.drops['char_backlog'] += 1  # the oldest crop of the track is pushed out
+            plate.queued_at = time.time()
+            track.awaiting_recognition.append(plate.uuid)
+        if plates:
+            self._keep_event_frame(frame)
             self._last_detection_timestamp = frame.timestamp
-            self._last_detection_pos = pos
-
-        self._is_occupied = is_occupied
-
-    def consider_event(self) -> None:
-        analyzer = Counter()
-        counter = Counter()
-        for frame_uuid in self.frames_timeline:
-            frame = self.frames[frame_uuid]
-            if frame.recognition is not None and frame.recognition.string is not None:
-                chars_confs = frame.recognition.confs
-                conf = frame.plate_detection.conf * sum(chars_confs) / len(chars_confs)
-                analyzer[frame.recognition.string] += conf
-                counter[frame.recognition.string] += 1
-        if not analyzer or not counter:
-            return
-        best, conf = analyzer.most_common(1)[0]
-        relative_conf = conf / analyzer.total() * 100
-        if relative_conf > self.CONF_THRESHOLD and counter[best] >= self.COUNT_THRESHOLD:
-            event_data = {
-                'stream_uuid': self.uuid,
-                'recognition': best,
-                'datetime': datetime.utcnow(),
-                'frame': self.frames[self.frames_timeline[-1]].original_image,
-            }
-            self.event_callback(event_data)
-
-    def on_chars_detection(self, result: dict, uuid: UUID):
+        self._drop_outdated()
+        self._enforce_budget()
+
+        self._is_occupied = bool(plates)
+
+    def consider_event(self, track: Track) -> Optional[dict]:
+        best = track.votes.decide()
+        if best is None:
+            return None
+        frame_ref, snapshot = self._event_image()
+        return {
+            'stream_uuid': self.uuid,
+            'recognition': best,
+            'datetime': datetime.utcnow(),
+            'frame_ref': frame_ref,  # pinned, released by the receiver
+            'frame': frame_ref.image if frame_ref is not None else snapshot,
+        }
+
+    def on_chars_detection(self, uuid: UUID, recognition: Optional[CharDetections]) -> Optional[dict]:
+        # publishes the chars Frame.read_chars has analyzed outside the lock, returns the event data of a decided
+        # track, the caller posts it after releasing the lock
         if uuid not in self.frames:
             logging.info(f'Frame was cleaned (old or recognized event), detection ignored.'
                          f'id# {uuid}')
-            return
-        self.frames[uuid].on_chars_detection(result)
-        self.consider_event()
-
-
+            return None
+        frame = self.frames[uuid]
+        frame.recognition = recognition
+        track = self.tracker.tracks.get(frame.track_id)
+        if track is None:
+            return None
+        if frame.recognition is not None:
+            track.votes.add(uuid, frame.recognition, frame.plate_detection.conf)
+        return self.consider_event(track)
@@ -0,0 +1,222 @@
+# NumPy/OpenCV counterparts of the predictors.ops functions used by postprocess,
+# so the lpr container does not need torch/torchvision to filter a few thousand candidates
+
+import math
+
+import cv2
+import numpy as np
+
+CV_CN_MAX = 512  # OpenCV limit of channels per image
+
+
+def xywh2xyxy(x):
+    assert x.shape[-1] == 4, f"input shape last dimension expected 4 but input shape is {x.shape}"
+    y = np.empty_like(x)
+    dw = x[..., 2] / 2  # half-width
+    dh = x[..., 3] / 2  # half-height
+    y[..., 0] = x[..., 0] - dw  # top left x
+    y[..., 1] = x[..., 1] - dh  # top left y
+    y[..., 2] = x[..., 0] + dw  # bottom right x
+    y[..., 3] = x[..., 1] + dh  # bottom right y
+    return y
+
+
+def nms(boxes, scores, iou_thres):
+    # greedy NMS, same semantics as torchvision.ops.nms: boxes with IoU > iou_thres are suppressed
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind='stable')
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def non_max_suppression(
+    prediction,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    agnostic=False,
+    max_det=300,
+    nc=0,  # number of classes (optional)
+    max_nms=30000,
+    max_wh=7680,
+):
+    # prediction: (batch_size, 4 + num_classes + num_masks, num_boxes), returns per image (n, 6 + num_masks)
+    # with columns (x1, y1, x2, y2, confidence, class, mask1, mask2, ...)
+    assert 0 <= conf_thres <= 1, f"Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0"
+    assert 0 <= iou_thres <= 1, f"Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0"
+
+    bs = prediction.shape[0]  # batch size
+    nc = nc or (prediction.shape[1] - 4)  # number of classes
+    nm = prediction.shape[1] - nc - 4
+    mi = 4 + nc  # mask start index
+    xc = prediction[:, 4:mi].max(1) > conf_thres  # candidates
+
+    output = [np.zeros((0, 6 + nm), dtype=prediction.dtype)] * bs
+    for xi in range(bs):
+        # candidates are filtered before the transpose, only a few of them survive the confidence threshold
+        x = prediction[xi][:, xc[xi]].T
+        if not x.shape[0]:
+            continue
+
+        box = xywh2xyxy(x[:, :4])
+        cls = x[:, 4:mi]
+        mask = x[:, mi:]
+
+        # best class only
+        j = cls.argmax(1)
+        conf = cls[np.arange(len(j)), j]
+        x = np.concatenate((box, conf[:, None], j[:, None].astype(x.dtype), mask), 1)[conf > conf_thres]
+
+        n = x.shape[0]  # number of boxes
+        if not n:
+            continue
+        if n > max_nms:  # excess boxes
+            x = x[x[:, 4].argsort()[::-1][:max_nms]]
+
+        # batched NMS, boxes are offset by class
+        c = x[:, 5:6] * (0 if agnostic else max_wh)
+        i = nms(x[:, :4] + c, x[:, 4], iou_thres)
+        output[xi] = x[i[:max_det]]
+
+    return output
+
+
+def clip_boxes(boxes, shape):
+    boxes[..., [0, 2]] = boxes[..., [0, 2]].clip(0, shape[1])  # x1, x2
+    boxes[..., [1, 3]] = boxes[..., [1, 3]].clip(0, shape[0])  # y1, y2
+    return boxes
+
+
+def scale_boxes(img1_shape, boxes, img0_shape, padding=True):
+    gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+    pad = (
+        round((img1_shape[1] - img0_shape[1] * gain) / 2 - 0.1),
+        round((img1_shape[0] - img0_shape[0] * gain) / 2 - 0.1),
+    )  # wh padding
+
+    if padding:
+        boxes[..., [0, 2]] -= pad[0]  # x padding
+        boxes[..., [1, 3]] -= pad[1]  # y padding
+    boxes[..., :4] /= gain
+    return clip_boxes(boxes, img0_shape)
+
+
+def clip_coords(coords, shape):
+    coords[..., 0] = coords[..., 0].clip(0, shape[1])  # x
+    coords[..., 1] = coords[..., 1].clip(0, shape[0])  # y
+    return coords
+
+
+def scale_coords(img1_shape, coords, img0_shape, padding=True):
+    gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+    pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2  # wh padding
+
+    if padding:
+        coords[..., 0] -= pad[0]  # x padding
+        coords[..., 1] -= pad[1]  # y padding
+    coords[..., 0] /= gain
+    coords[..., 1] /= gain
+    return clip_coords(coords, img0_shape)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def crop_mask(masks, boxes):
+    # zeroes masks (n, h, w) outside of their boxes (n, 4)
+    n, h, w = masks.shape
+    x1, y1, x2, y2 = np.split(boxes[:, :, None], 4, 1)  # x1 shape(n,1,1)
+    r = np.arange(w, dtype=x1.dtype)[None, None, :]  # rows shape(1,1,w)
+    c = np.arange(h, dtype=x1.dtype)[None, :, None]  # cols shape(1,h,1)
+    return masks * ((r >= x1) * (r < x2) * (c >= y1) * (c < y2))
+
+
+def resize_masks(masks, shape):
+    # bilinear (half-pixel centers) resize of (n, h, w) masks, same as F.interpolate(align_corners=False)
+    n = masks.shape[0]
+    resized = np.empty((n, *shape), dtype=masks.dtype)
+    for start in range(0, n, CV_CN_MAX):
+        chunk = masks[start:start + CV_CN_MAX].transpose(1, 2, 0)
+        chunk = cv2.resize(chunk, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+        resized[start:start + CV_CN_MAX] = chunk.reshape(*shape, -1).transpose(2, 0, 1)
+    return resized
+
+
+def scale_masks(masks, shape, padding=True):
+    # masks (n, h, w) are cropped to the letterboxed image and resized to shape (h, w)
+    mh, mw = masks.shape[1:]
+    gain = min(mh / shape[0], mw / shape[1])  # gain  = old / new
+    pad = [mw - shape[1] * gain, mh - shape[0] * gain]  # wh padding
+    if padding:
+        pad[0] /= 2
+        pad[1] /= 2
+    top, left = (int(pad[1]), int(pad[0])) if padding else (0, 0)  # y, x
+    bottom, right = (int(mh - pad[1]), int(mw - pad[0]))
+    masks = masks[:, top:bottom, left:right]
+    return resize_masks(masks, shape)
+
+
+def process_mask_native(protos, masks_in, bboxes, shape):
+    c, mh, mw = protos.shape  # CHW
+    masks = sigmoid(masks_in @ protos.reshape(c, -1)).reshape(-1, mh, mw)
+    masks = scale_masks(masks, shape)
+    masks = crop_mask(masks, bboxes)
+    return masks > 0.5
+
+
+def process_mask_segments(protos, masks_in, bboxes, shape):
+    # same contours as masks2segments(process_mask_native(...)), but every mask is decoded and upsampled
+    # only inside its own box instead of the whole input canvas, so the cost does not depend on the input size
+    c, mh, mw = protos.shape  # CHW
+    ih, iw = shape
+    factor = iw // mw
+    if mw * factor != iw or mh * factor != ih:  # protos are not an integer downscale of the input
+        return masks2segments(process_mask_native(protos, masks_in, bboxes, shape))
+
+    segments = []
+    for mask_in, (x1, y1, x2, y2) in zip(masks_in, bboxes):
+        # output pixels kept by crop_mask: x1 <= x < x2, y1 <= y < y2
+        bx1, by1 = max(0, math.ceil(x1)), max(0, math.ceil(y1))
+        bx2, by2 = min(iw, math.ceil(x2)), min(ih, math.ceil(y2))
+        if bx2 <= bx1 or by2 <= by1:
+            segments.append(np.zeros((0, 2), dtype="float32"))
+            continue
+
+        # proto window covering all bilinear neighbours of the box pixels, plus a margin of one proto pixel
+        px1, py1 = max(0, bx1 // factor - 1), max(0, by1 // factor - 1)
+        px2, py2 = min(mw, (bx2 - 1) // factor + 2), min(mh, (by2 - 1) // factor + 2)
+        window = protos[:, py1:py2, px1:px2]
+        wh, ww = window.shape[1:]
+        mask = sigmoid(mask_in @ window.reshape(c, -1)).reshape(wh, ww)
+        mask = cv2.resize(mask, (ww * factor, wh * factor), interpolation=cv2.INTER_LINEAR)
+
+        ox, oy = px1 * factor, py1 * factor
+        mask = (mask[by1 - oy:by2 - oy, bx1 - ox:bx2 - ox] > 0.5).astype(np.uint8)
+        segment = masks2segments(mask[None])[0]
+        segment += np.array([bx1, by1], dtype=segment.dtype)
+        segments.append(segment)
+    return segments
+
+
+def masks2segments(masks):
+    # largest contour of each (n, h, w) mask
+    segments = []
+    for x in masks.astype(np.uint8):
+        c = cv2.findContours(x, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        if c:
+            c = np.array(c[np.array([len(x) for x in c]).argmax()]).reshape(-1, 2)
+        else:
+            c = np.zeros((0, 2))  # no segments found
+        segments.append(c.astype("float32"))
+    return segments
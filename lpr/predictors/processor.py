@@ -2,6 +2,29 @@ import re
 import cv2
 import numpy as np
 from functools import cached_property
+from typing import Optional
+
+from data.config import config
+from predictors.rectify import PlateRectifier, solve_corners, warp_plate
+
+
+PLATE_PATTERNS = [
+    (r'^([a-ce-z])(\d{3})([a-ce-z]{2})(\d{2,3})$', "car"),  # 'a000aa00'
+    (r'^([a-ce-z]{2})(\d{3})(\d{2,3})$', "public"),  # 'aa00000'
+    (r'^(\d{4})([a-ce-z]{2})(\d{2,3})$', "military"),  # '0000aa00'
+    (r'^(\d{3})(d)(\d{3})(\d{2})$', "diplomatic"),  # '000d00000'
+    (r'^([a-ce-z])(\d{4})(\d{2,3})$', "police"),  # 'a000000'
+]
+
+
+def parse_plate(string: str):
+    for pattern, plate_type in PLATE_PATTERNS:
+        match = re.match(pattern, string)
+        if match:
+            parts = match.groups()
+            return True, plate_type, parts
+
+    return False, None, None
 
 
 class CharDetection:
@@ -203,21 +226,7 @@ class CharDetections:
     @cached_property
     def parsed_string(self):
         string = ''.join([ch.analyzed_name or ch.name for ch in self.post_processed]).lower()
-        patterns = [
-            (r'^([a-ce-z])(\d{3})([a-ce-z]{2})(\d{2,3})$', "car"),  # 'a000aa00'
-            (r'^([a-ce-z]{2})(\d{3})(\d{2,3})$', "public"),  # 'aa00000'
-            (r'^(\d{4})([a-ce-z]{2})(\d{2,3})$', "military"),  # '0000aa00'
-            (r'^(\d{3})(d)(\d{3})(\d{2})$', "diplomatic"),  # '000d00000'
-            (r'^([a-ce-z])(\d{4})(\d{2,3})$', "police"),  # 'a000000'
-        ]
-
-        for pattern, plate_type in patterns:
-            match = re.match(pattern, string)
-            if match:
-                parts = match.groups()
-                return True, plate_type, parts
-
-        return False, None, None
+        return parse_plate(string)
 
     @cached_property
     def is_valid(self):
@@ -232,16 +241,16 @@ class CharDetections:
 
 
 class PlatePrediction:
+    FULL_HEIGHT = config['quality']['full_height']
+    FULL_SHARPNESS = config['quality']['full_sharpness']
+    ASPECT_SINGLE = config['quality']['aspect_single']
+    ASPECT_DOUBLE = config['quality']['aspect_double']
+
     def __init__(self, box, mask, cls, name, conf, parent):
         self.box = box
         self.box_area = box[-1] * box[-2]
         self.mask = mask.astype(int)
 
-        self.contour = self.mask.reshape(-1, 1, 2)
-        epsilon = 0.001 * cv2.arcLength(self.contour, True)
-        self.contour = cv2.approxPolyDP(self.contour, epsilon, True)
-        self.contour = cv2.convexHull(self.contour)
-
         self.cls = cls
         self.name = name
         self.conf = conf
@@ -262,43 +271,25 @@ class PlatePrediction:
 
         return np.array([tl, tr, br, bl], dtype="float32")
 
-    @staticmethod
-    def find_intersection(p1, p2, p3, p4):
-        x1, y1 = p1
-        x2, y2 = p2
-        x3, y3 = p3
-        x4, y4 = p4
-
-        a1 = y2 - y1
-        b1 = x1 - x2
-        c1 = a1 * x1 + b1 * y1
-
-        a2 = y4 - y3
-        b2 = x3 - x4
-        c2 = a2 * x3 + b2 * y3
-
-        determinant = a1 * b2 - a2 * b1
-
-        if determinant == 0:
-            return None
-
-        x = (b2 * c1 - b1 * c2) / determinant
-        y = (a1 * c2 - a2 * c1) / determinant
+    @cached_property
+    def contour(self):
+        contour = self.mask.reshape(-1, 1, 2)
+        epsilon = 0.001 * cv2.arcLength(contour, True)
+        contour = cv2.approxPolyDP(contour, epsilon, True)
+        return cv2.convexHull(contour)
 
-        return [x, y]
+    def solve_corners(self):
+        box = self.order_points_clockwise(cv2.boxPoints(cv2.minAreaRect(self.contour)))
+        corners = solve_corners(box, self.box)
+        return corners if corners is not None else box.astype("int32")
 
     @cached_property
     def corners(self):
-        min_area_rect = cv2.minAreaRect(self.contour)
-        box = cv2.boxPoints(min_area_rect)
-        box = self.order_points_clockwise(box)
-
-        tl = self.find_intersection(*box[:2], [self.box[0], self.box[1]], [self.box[0], self.box[3]])
-        tr = self.find_intersection(*box[:2], [self.box[2], self.box[1]], [self.box[2], self.box[3]])
-        br = self.find_intersection(*box[2:], [self.box[2], self.box[1]], [self.box[2], self.box[3]])
-        bl = self.find_intersection(*box[2:], [self.box[0], self.box[1]], [self.box[0], self.box[3]])
-
-        return np.array([tl, tr, br, bl], dtype="int32")
+        # a calibrated camera skips the contour solve for plates in the spots it has learned
+        rectifier = self.parent.rectifier
+        if rectifier is None:
+            return self.solve_corners()
+        return rectifier.corners(self.box, self.cls, (self.parent.h, self.parent.w), self.solve_corners)
 
     @cached_property
     def cropped(self):
@@ -312,15 +303,27 @@ class PlatePrediction:
         if self.cls == 1 or too_narrow:
             h *= 2
 
-        dst_pts = np.float32(
-            [[border_w, border_h], [w - border_w, border_h], [w - border_w, h - border_h], [border_w, h - border_h]])
-        matrix = cv2.getPerspectiveTransform(src_pts, dst_pts)
-        image_transformed = cv2.warpPerspective(self.parent.img, matrix, (w, h))
-        return image_transformed
+        return warp_plate(self.parent.img, src_pts, (w, h), (border_w, border_h))
+
+    @cached_property
+    def quality(self) -> float:
+        # 0..1 chance of a readable crop from what is at hand: detection confidence, plate height in pixels,
+        # corner aspect ratio against the plate format (skew, partial plates) and sharpness of the crop
+        size = min(1., (self.box[3] - self.box[1]) / self.FULL_HEIGHT)
+
+        tl, tr, _, bl = self.corners.astype(np.float32)
+        aspect = np.linalg.norm(tr - tl) / max(np.linalg.norm(bl - tl), 1.)
+        expected = self.ASPECT_DOUBLE if self.cls == 1 or aspect < 1.8 else self.ASPECT_SINGLE
+        shape = min(aspect / expected, expected / aspect) if aspect > 0 else 0.
+
+        gray = cv2.cvtColor(self.cropped, cv2.COLOR_BGR2GRAY)
+        sharpness = min(1., cv2.Laplacian(gray, cv2.CV_64F).var() / self.FULL_SHARPNESS)
+
+        return float(self.conf * size * shape * sharpness)
 
 
 class PlatePredictions:
-    def __init__(self, result, img):
+    def __init__(self, result, img, rectifier: Optional[PlateRectifier] = None):
         self.boxes = result['det'][:, :4]
         self.masks = result['seg']
         self.names = {i: str(i) for i in range(6)}
@@ -328,11 +331,22 @@ class PlatePredictions:
         self.conf = list(map(float, result['det'][:, 4]))
         self.img = img
         self.h, self.w = img.shape[:2]
-        self.n = len(self.cls)
-        self.plates: list[PlatePrediction] = []
-
-        for i in range(self.n):
-            plate = PlatePrediction(
+        self.rectifier = rectifier
+        # only the most confident detections come with a mask (postprocess.max_masks)
+        self.n = min(len(self.cls), len(self.masks))
+        self._plates: dict[int, PlatePrediction] = {}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i) -> PlatePrediction:
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(f'plate index {i} out of range')
+        # contours are approximated only for the plates that are actually used
+        if i not in self._plates:
+            self._plates[i] = PlatePrediction(
                 np.array(self.boxes[i], dtype="int32"),
                 self.masks[i],
                 self.cls[i],
@@ -340,5 +354,12 @@ class PlatePredictions:
                 self.conf[i],
                 self,
             )
-            self.plates.append(plate)
+        return self._plates[i]
+
+    @property
+    def plates(self) -> list[PlatePrediction]:
+        return [self[i] for i in range(self.n)]
 
+    def release_image(self) -> None:
+        # plates cropped before keep their crops, the full frame is not referenced any more
+        self.img = None
@@ -0,0 +1,81 @@
+from threading import Lock
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+from data.config import config
+
+# the two edges of the min area rect that run along the plate, cut by the vertical sides of the detection box
+EDGE_STARTS = [0, 0, 2, 2]
+EDGE_ENDS = [1, 1, 3, 3]
+
+
+def solve_corners(rect: np.ndarray, box: np.ndarray) -> Optional[np.ndarray]:
+    # tl, tr, br, bl: the top and bottom edges of the clockwise ordered min area rect intersected with
+    # x = box[0] and x = box[2] in one go, None if an edge is vertical
+    starts, ends = rect[EDGE_STARTS].astype(np.float64), rect[EDGE_ENDS].astype(np.float64)
+    dx = ends[:, 0] - starts[:, 0]
+    if np.any(dx == 0):
+        return None
+    xs = np.array([box[0], box[2], box[2], box[0]], np.float64)
+    ys = starts[:, 1] + (xs - starts[:, 0]) * (ends[:, 1] - starts[:, 1]) / dx
+    return np.stack([xs, ys], axis=1).astype(np.int32)
+
+
+def warp_plate(image: np.ndarray, corners: np.ndarray, size: tuple[int, int], border: tuple[int, int]) -> np.ndarray:
+    w, h = size
+    border_w, border_h = border
+    src_pts = np.float32(corners)
+    dst_pts = np.float32(
+        [[border_w, border_h], [w - border_w, border_h], [w - border_w, h - border_h], [border_w, h - border_h]])
+    matrix = cv2.getPerspectiveTransform(src_pts, dst_pts)
+    return cv2.warpPerspective(image, matrix, (w, h))
+
+
+class PlateRectifier:
+    # per camera cache of the plate corner shape: a fixed camera sees plates in one spot of the frame with the
+    # same perspective, so once the corners solved for a grid cell agree, the cell shape is scaled to the
+    # detection box instead of solving the mask contour again, every verify_every-th plate is still solved
+    GRID = config['rectification']['grid']
+    SAMPLES = config['rectification']['samples']
+    TOLERANCE = config['rectification']['tolerance']
+    VERIFY_EVERY = config['rectification']['verify_every']
+
+    def __init__(self):
+        self._lock = Lock()  # plate results of one camera come from several inference callback threads
+        self._cells: dict[tuple, list] = {}  # cell -> [mean shape, deviation, samples, hits]
+        self.hits = 0
+        self.solves = 0
+
+    def _cell(self, box: np.ndarray, cls: int, image_shape: tuple) -> tuple:
+        h, w = image_shape[:2]
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        return cls, min(int(cx / w * self.GRID), self.GRID - 1), min(int(cy / h * self.GRID), self.GRID - 1)
+
+    def corners(self, box: np.ndarray, cls: int, image_shape: tuple,
+                solve: Callable[[], np.ndarray]) -> np.ndarray:
+        # the shape is the y of the four corners relative to the box, the x are the box sides by construction
+        bh = max(box[3] - box[1], 1)
+        key = self._cell(box, cls, image_shape)
+        with self._lock:
+            cell = self._cells.get(key)
+            if cell is not None and cell[2] >= self.SAMPLES and cell[1] <= self.TOLERANCE:
+                cell[3] += 1
+                if cell[3] % self.VERIFY_EVERY:
+                    self.hits += 1
+                    ys = box[1] + cell[0] * bh
+                    xs = np.array([box[0], box[2], box[2], box[0]])
+                    return np.stack([xs, ys], axis=1).astype(np.int32)
+
+        corners = solve()
+        shape = (corners[:, 1] - box[1]) / bh
+        with self._lock:
+            self.solves += 1
+            cell = self._cells.setdefault(key, [shape, 0., 0, 0])
+            cell[2] += 1
+            rate = 1 / min(cell[2], self.SAMPLES)
+            deviation = float(np.abs(shape - cell[0]).max())
+            cell[0] = cell[0] + rate * (shape - cell[0])
+            cell[1] += rate * (deviation - cell[1])
+        return corners
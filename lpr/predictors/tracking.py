@@ -0,0 +1,105 @@
+import itertools
+from collections import deque
+from uuid import UUID
+
+import numpy as np
+
+from data.config import config
+from predictors.voting import create_votes
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.
+    intersection = w * h
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+class Track:
+    # one vehicle plate followed across frames, with its own recognition vote and char crop queue
+    __slots__ = 'id', 'box', 'velocity', 'updated_at', 'timeline', 'awaiting_recognition', 'votes'
+
+    def __init__(self, track_id: int, box: np.ndarray, timestamp: float, votes, timeline: int):
+        self.id = track_id
+        self.box = box.astype(np.float32)
+        self.velocity = np.zeros(2, np.float32)  # box center, pixels per second
+        self.updated_at = timestamp
+        self.timeline: deque[UUID] = deque(maxlen=timeline)  # plate frames voting for this track
+        self.awaiting_recognition: deque[UUID] = deque(maxlen=timeline)
+        self.votes = votes  # PlateVotes or CharConsensus
+
+    def predict(self, timestamp: float) -> np.ndarray:
+        shift = self.velocity * (timestamp - self.updated_at)
+        return self.box + np.concatenate([shift, shift])
+
+    def update(self, box: np.ndarray, timestamp: float, smoothing: float) -> None:
+        dt = timestamp - self.updated_at
+        if dt > 0:
+            shift = (box[:2] + box[2:4] - self.box[:2] - self.box[2:4]) / 2
+            self.velocity += smoothing * (shift / dt - self.velocity)
+        self.box = box.astype(np.float32)
+        self.updated_at = max(self.updated_at, timestamp)
+
+
+class PlateTracker:
+    # greedy association of plate boxes to tracks: IoU with the motion predicted box first, the centroid
+    # distance relative to the plate size for plates that moved too far between two inferences
+    MIN_IOU = config['tracking']['min_iou']
+    MAX_DISTANCE = config['tracking']['max_distance']
+    MAX_AGE = config['tracking']['max_age']
+    SMOOTHING = config['tracking']['smoothing']
+    TIMELINE = config['tracking']['timeline']
+
+    def __init__(self, decision: str):
+        self._decision = decision
+        self._ids = itertools.count()
+        self.tracks: dict[int, Track] = {}
+
+    def expire(self, now: float) -> list[Track]:
+        expired = [track for track in self.tracks.values() if now - track.updated_at > self.MAX_AGE]
+        for track in expired:
+            del self.tracks[track.id]
+        return expired
+
+    def update(self, boxes: list[np.ndarray], timestamp: float) -> list[Track]:
+        # track of every box, in the order of boxes, new tracks for the unmatched ones
+        predicted = {track_id: track.predict(timestamp) for track_id, track in self.tracks.items()}
+        matches: dict[int, Track] = {}
+
+        pairs = [
+            (iou(box, predicted[track_id]), i, track_id)
+            for i, box in enumerate(boxes) for track_id in predicted
+        ]
+        self._match(sorted((pair for pair in pairs if pair[0] >= self.MIN_IOU), reverse=True), matches, predicted)
+
+        pairs = []
+        for i, box in enumerate(boxes):
+            if i in matches:
+                continue
+            center = (box[:2] + box[2:4]) / 2
+            for track_id, track_box in predicted.items():
+                size = max(track_box[2] - track_box[0], track_box[3] - track_box[1], 1.)
+                distance = np.linalg.norm(center - (track_box[:2] + track_box[2:4]) / 2) / size
+                if distance <= self.MAX_DISTANCE:
+                    pairs.append((-distance, i, track_id))
+        self._match(sorted(pairs, reverse=True), matches, predicted)
+
+        tracks = []
+        for i, box in enumerate(boxes):
+            track = matches.get(i)
+            if track is None:
+                track = Track(next(self._ids), box, timestamp, create_votes(self._decision), self.TIMELINE)
+                self.tracks[track.id] = track
+            else:
+                track.update(box, timestamp, self.SMOOTHING)
+            tracks.append(track)
+        return tracks
+
+    def _match(self, pairs: list[tuple], matches: dict[int, Track], predicted: dict[int, np.ndarray]) -> None:
+        for _, i, track_id in pairs:
+            if i in matches or track_id not in predicted:
+                continue
+            matches[i] = self.tracks[track_id]
+            del predicted[track_id]
@@ -1,14 +1,42 @@
 import cv2
 import numpy as np
-import torch
 from openvino import InferRequest
-from predictors import ops
+
+from data.config import config
+from predictors import ops_numpy
+
+# 'numpy' keeps torch out of the process, 'torch' uses the original ultralytics ops (requirements-torch.txt)
+POSTPROCESS_BACKEND = config['postprocess']['backend']
+# masks and contours are decoded only for that many most confident detections
+MAX_MASKS = config['postprocess']['max_masks']
+
+
+def crop_roi(image: np.ndarray, roi: dict) -> tuple[np.ndarray, tuple[int, int]]:
+    # roi is given in relative borders (x_min, x_max, y_min, y_max), the crop is a view, not a copy
+    h, w = image.shape[:2]
+    x_min, x_max = int(roi['x_min'] * w), int(roi['x_max'] * w)
+    y_min, y_max = int(roi['y_min'] * h), int(roi['y_max'] * h)
+    return image[y_min:y_max, x_min:x_max], (x_min, y_min)
+
+
+def shift_predictions(detections: np.ndarray, segments, offset: tuple[int, int]):
+    # maps boxes and mask contours of a cropped image back to the full frame
+    x, y = offset
+    if not x and not y:
+        return detections, segments
+    if len(detections):
+        detections[:, [0, 2]] += x
+        detections[:, [1, 3]] += y
+    if segments is not None:
+        segments = [segment + np.array([x, y], dtype=segment.dtype) for segment in segments]
+    return detections, segments
 
 
 def letterbox_image(
         image: np.ndarray,
         target_size: tuple[int, int],
         stride: int = 32,
+        auto: bool = True,
 ) -> np.ndarray:
     ih, iw = image.shape[:2]
     tw, th = target_size
@@ -18,11 +46,12 @@ def letterbox_image(
 
     new_image = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
 
-    vertical = (th - nh) % stride
-    horizontal = (tw - nw) % stride
+    # auto: pad only up to the stride multiple, otherwise pad to the full target size (fixed batch shape)
+    vertical = (th - nh) % stride if auto else th - nh
+    horizontal = (tw - nw) % stride if auto else tw - nw
 
-    top = (th - nh) % stride // 2
-    left = (tw - nw) % stride // 2
+    top = vertical // 2
+    left = horizontal // 2
     bottom = vertical - top
     right = horizontal - left
 
@@ -42,43 +71,76 @@ def image_to_tensor(image: np.ndarray):
     return input_tensor
 
 
-def clip_coords(coords, shape):
-    if isinstance(coords, torch.Tensor):  # faster individually (WARNING: inplace .clamp_() Apple MPS bug)
-        coords[..., 0] = coords[..., 0].clamp(0, shape[1])  # x
-        coords[..., 1] = coords[..., 1].clamp(0, shape[0])  # y
-    else:  # np.array (faster grouped)
-        coords[..., 0] = coords[..., 0].clip(0, shape[1])  # x
-        coords[..., 1] = coords[..., 1].clip(0, shape[0])  # y
-    return coords
+def postprocess(request: InferRequest, input_hw: tuple[int, int], original_shapes: list, number_classes: int) -> list:
+    # padding entries of a partially filled batch are not processed
+    batch = len(original_shapes)
+    pred_boxes = request.get_output_tensor(0).data[:batch]
+    pred_masks = request.get_output_tensor(1).data[:batch] if len(request.outputs) > 1 else None
+
+    return postprocess_outputs(pred_boxes, pred_masks, input_hw, original_shapes, number_classes)
+
 
+def postprocess_outputs(pred_boxes, pred_masks, input_hw, original_shapes: list, number_classes: int,
+                        backend: str = None) -> list:
+    if (backend or POSTPROCESS_BACKEND) == 'torch':
+        return _postprocess_torch(pred_boxes, pred_masks, input_hw, original_shapes, number_classes)
+    return _postprocess_numpy(pred_boxes, pred_masks, input_hw, original_shapes, number_classes)
 
-def postprocess(request: InferRequest, original_shape, number_classes: int):
-    input_hw = request.get_input_tensor(0).data.shape[2:]
 
-    pred_boxes = request.get_output_tensor(0).data
-    pred_masks = request.get_output_tensor(1).data if len(request.outputs) > 1 else None
+def _postprocess_numpy(pred_boxes, pred_masks, input_hw, original_shapes, number_classes):
+    preds = ops_numpy.non_max_suppression(pred_boxes, nc=number_classes, iou_thres=0.2)
 
-    # only first from the batch
-    pred = ops.non_max_suppression(
+    results = []
+    for i, (pred, original_shape) in enumerate(zip(preds, original_shapes)):
+        detections = np.array([])
+        segments = np.array([]) if pred_masks is not None else None
+
+        if len(pred) == 0:
+            results.append((detections, segments))
+            continue
+
+        if pred_masks is not None:
+            top = pred[:MAX_MASKS]
+            segments = [
+                ops_numpy.scale_coords(input_hw, x, original_shape)
+                for x in ops_numpy.process_mask_segments(pred_masks[i], top[:, 6:], top[:, :4], input_hw)
+            ]
+
+        pred[:, :4] = ops_numpy.scale_boxes(input_hw, pred[:, :4], original_shape).round()
+        detections = pred[:, :6]
+        results.append((detections, segments))
+
+    return results
+
+
+def _postprocess_torch(pred_boxes, pred_masks, input_hw, original_shapes, number_classes):
+    import torch
+    from predictors import ops
+
+    preds = ops.non_max_suppression(
         torch.from_numpy(pred_boxes),
         nc=number_classes,
         iou_thres=0.2
-    )[0]
-    proto = torch.from_numpy(pred_masks)[0] if pred_masks is not None else None
+    )
+    protos = torch.from_numpy(pred_masks) if pred_masks is not None else None
 
-    detections = np.array([])
-    segments = np.array([]) if pred_masks is not None else None
+    results = []
+    for i, (pred, original_shape) in enumerate(zip(preds, original_shapes)):
+        detections = np.array([])
+        segments = np.array([]) if protos is not None else None
 
-    if len(pred) == 0:
-        return detections, segments
+        if len(pred) == 0:
+            results.append((detections, segments))
+            continue
 
-    if proto is not None:
-        masks = ops.process_mask_native(proto, pred[:, 6:], pred[:, :4], input_hw)
-        segments = [
-            ops.scale_coords(input_hw, x, original_shape, normalize=False) for x in ops.masks2segments(masks)
-        ]
+        if protos is not None:
+            masks = ops.process_mask_native(protos[i], pred[:MAX_MASKS, 6:], pred[:MAX_MASKS, :4], input_hw)
+            segments = [
+                ops.scale_coords(input_hw, x, original_shape, normalize=False) for x in ops.masks2segments(masks)
+            ]
 
-    pred[:, :4] = ops.scale_boxes(input_hw, pred[:, :4], original_shape).round()
-    detections = pred[:, :6].numpy()
+        pred[:, :4] = ops.scale_boxes(input_hw, pred[:, :4], original_shape).round()
+        detections = pred[:, :6].numpy()
+        results.append((detections, segments))
 
-    return detections, segments
+    return results
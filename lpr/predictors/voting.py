@@ -0,0 +1,202 @@
+import math
+from collections import Counter
+from typing import Optional
+from uuid import UUID
+
+from data.config import config
+from predictors.processor import CharDetections, parse_plate
+
+
+class PlateVotes:
+    # running vote over the recognitions of the detector timeline: a frame votes once when its chars arrive
+    # and its vote is taken back when it leaves the timeline, so a decision does not rescan the timeline
+    def __init__(self, conf_threshold: float, count_threshold: int):
+        self.conf_threshold = conf_threshold  # percent of the total vote weight
+        self.count_threshold = count_threshold
+        self._votes: dict[UUID, tuple[str, float]] = {}
+        self._weights = Counter()
+        self._counts = Counter()
+        self._total = 0.
+
+    def __len__(self) -> int:
+        return len(self._votes)
+
+    def add(self, uuid: UUID, chars: CharDetections, plate_conf: float) -> None:
+        # only valid plate strings vote, weighted by the plate and the mean char confidence
+        if chars.string is None:
+            return
+        recognition, weight = chars.string, plate_conf * sum(chars.confs) / len(chars.confs)
+        self.remove(uuid)
+        self._votes[uuid] = recognition, weight
+        self._weights[recognition] += weight
+        self._counts[recognition] += 1
+        self._total += weight
+
+    def remove(self, uuid: UUID) -> None:
+        vote = self._votes.pop(uuid, None)
+        if vote is None:
+            return
+        recognition, weight = vote
+        self._counts[recognition] -= 1
+        if self._counts[recognition]:
+            self._weights[recognition] -= weight
+            self._total -= weight
+        else:
+            # no float residue is left behind for a string that has no votes
+            del self._counts[recognition], self._weights[recognition]
+            self._total = sum(self._weights.values())
+
+    def clear(self) -> None:
+        self._votes.clear()
+        self._weights.clear()
+        self._counts.clear()
+        self._total = 0.
+
+    def decide(self) -> Optional[str]:
+        # leading recognition once it holds enough of the weight and enough frames, None otherwise
+        if not self._weights or self._total <= 0:
+            return None
+        best, weight = self._weights.most_common(1)[0]
+        if weight / self._total * 100 > self.conf_threshold and self._counts[best] >= self.count_threshold:
+            return best
+        return None
+
+
+class CharConsensus:
+    # position-wise fusion of the char reads of a track: reads of one length are aligned by position and every
+    # position sums the confidences of its chars, so a read with one misread char still supports the other
+    # positions. The consensus is decided once every position leads its runner-up by the margin.
+    # Reads are not aligned across lengths: a read with a dropped or an extra char votes only with the reads of
+    # its own length, and only the most common length is decided, so such reads do not support the consensus.
+
+    def __init__(self, margin: float, min_length: int):
+        self.margin = margin  # summed plate x char confidence
+        self.min_length = min_length  # shorter reads are ignored
+        self._reads: dict[UUID, list[tuple[str, float]]] = {}
+        self._positions: dict[int, list[Counter]] = {}  # read length -> char weights of every position
+        self._lengths = Counter()  # read length -> reads
+
+    def __len__(self) -> int:
+        return len(self._reads)
+
+    def add(self, uuid: UUID, chars: CharDetections, plate_conf: float) -> None:
+        # invalid strings vote too, their misread chars are outvoted position by position
+        read = [((ch.analyzed_name or ch.name).lower(), plate_conf * ch.conf) for ch in chars.post_processed]
+        if len(read) < self.min_length:
+            return
+        self.remove(uuid)
+        self._reads[uuid] = read
+        self._lengths[len(read)] += 1
+        positions = self._positions.setdefault(len(read), [Counter() for _ in read])
+        for position, (char, weight) in zip(positions, read):
+            position[char] += weight
+
+    def remove(self, uuid: UUID) -> None:
+        read = self._reads.pop(uuid, None)
+        if read is None:
+            return
+        self._lengths[len(read)] -= 1
+        if not self._lengths[len(read)]:
+            del self._lengths[len(read)], self._positions[len(read)]
+            return
+        for position, (char, weight) in zip(self._positions[len(read)], read):
+            position[char] -= weight
+            if position[char] <= 1e-9:
+                del position[char]
+
+    def clear(self) -> None:
+        self._reads.clear()
+        self._positions.clear()
+        self._lengths.clear()
+
+    def decide(self) -> Optional[str]:
+        if not self._lengths:
+            return None
+        length, _ = self._lengths.most_common(1)[0]
+        consensus = []
+        for position in self._positions[length]:
+            ranked = position.most_common(2) + [('', 0.)]
+            (char, weight), (_, runner_up) = ranked[0], ranked[1]
+            if weight - runner_up < self.margin:
+                return None
+            consensus.append(char)
+        string = ''.join(consensus)
+        return string if parse_plate(string)[0] else None
+
+
+class SequentialVotes(PlateVotes):
+    # Wald's sequential probability ratio test on the leading string: a read of that string with confidence q
+    # adds log(q / misread) to its evidence, any other read adds log((1 - q) / (1 - misread)), and the string
+    # is decided as soon as the evidence crosses log((1 - error_rate) / error_rate). Ambiguous tracks that
+    # never get there are still decided by the count rule.
+    def __init__(self, conf_threshold: float, count_threshold: int, misread: float, error_rate: float):
+        super().__init__(conf_threshold, count_threshold)
+        self.misread = misread  # chance of a wrong plate read as exactly the leading string
+        self.threshold = math.log((1 - error_rate) / error_rate)
+        self._reads: dict[UUID, tuple[Optional[str], float, float]] = {}  # string, match and miss evidence
+        self._match = Counter()  # string -> match evidence of its reads
+        self._own_miss = Counter()  # string -> miss evidence of its reads
+        self._miss = 0.  # miss evidence of all reads, invalid strings included
+
+    def add(self, uuid: UUID, chars: CharDetections, plate_conf: float) -> None:
+        super().add(uuid, chars, plate_conf)
+        self._remove_read(uuid)
+        if not chars.confs:
+            return
+        q = min(max(plate_conf * sum(chars.confs) / len(chars.confs), 0.01), 0.99)
+        string, match, miss = chars.string, math.log(q / self.misread), math.log((1 - q) / (1 - self.misread))
+        self._reads[uuid] = string, match, miss
+        self._miss += miss
+        if string is not None:
+            self._match[string] += match
+            self._own_miss[string] += miss
+
+    def _remove_read(self, uuid: UUID) -> None:
+        read = self._reads.pop(uuid, None)
+        if read is None:
+            return
+        string, match, miss = read
+        self._miss = self._miss - miss if self._reads else 0.
+        if string is None:
+            return
+        if any(other == string for other, _, _ in self._reads.values()):
+            self._match[string] -= match
+            self._own_miss[string] -= miss
+        else:
+            del self._match[string], self._own_miss[string]
+
+    def remove(self, uuid: UUID) -> None:
+        self._remove_read(uuid)
+        super().remove(uuid)
+
+    def clear(self) -> None:
+        super().clear()
+        self._reads.clear()
+        self._match.clear()
+        self._own_miss.clear()
+        self._miss = 0.
+
+    def evidence(self, string: str) -> float:
+        return self._match[string] + self._miss - self._own_miss[string]
+
+    def decide(self) -> Optional[str]:
+        if self._match:
+            best = max(self._match, key=self.evidence)
+            if self.evidence(best) >= self.threshold:
+                return best
+        return super().decide()
+
+
+def create_votes(decision: str):
+    # decision policy of a track: 'count' - whole strings by relative confidence and count, 'consensus' - chars,
+    # 'sequential' - whole strings by a sequential test, the count rule for ambiguous reads
+    if decision == 'consensus':
+        return CharConsensus(config['detector']['consensus_margin'], config['detector']['consensus_min_length'])
+    if decision == 'sequential':
+        return SequentialVotes(
+            config['detector']['conf_threshold'],
+            config['detector']['count_threshold'],
+            config['detector']['sequential_misread'],
+            config['detector']['sequential_error_rate'],
+        )
+    return PlateVotes(config['detector']['conf_threshold'], config['detector']['count_threshold'])
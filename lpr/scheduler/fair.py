@@ -0,0 +1,104 @@
+import time
+from typing import Iterable, Optional
+from uuid import UUID
+
+from data.config import config
+
+
+class Share:
+    def __init__(self, weight: float, fps: float):
+        self.weight = weight
+        self.min_interval = 1 / fps if fps else 0.
+        self.limit_interval = 0.  # temporary limit, set by the overload controller
+        self.limit_reason: Optional[str] = None
+        self.finish = 0.  # virtual finish time of the last dispatched frame
+        self.dispatched_at = 0.
+        self.held_until = 0.  # not eligible before that, without being charged for a dispatch
+
+        # statistics window, reset by FairScheduler.stats
+        self.frames = 0
+        self.delay_sum = 0.
+        self.delay_max = 0.
+
+
+class FairScheduler:
+    # start-time fair queuing over cameras: every dispatched frame costs 1 / weight of virtual time,
+    # the camera with the smallest virtual start time goes next, so equal weights give round-robin
+    WEIGHT = config['scheduler']['default_weight']
+    FPS = config['scheduler']['default_fps']
+
+    def __init__(self):
+        self.shares: dict[UUID, Share] = {}
+        self._virtual_time = 0.
+        self._stats_since = time.monotonic()
+
+    def add(self, uuid: UUID, weight: Optional[float] = None, fps: Optional[float] = None) -> None:
+        self.shares[uuid] = Share(weight or self.WEIGHT, self.FPS if fps is None else fps)
+
+    def remove(self, uuid: UUID) -> None:
+        self.shares.pop(uuid, None)
+
+    def limit(self, uuid: UUID, fps: float, reason: Optional[str] = None) -> None:
+        share = self.shares[uuid]
+        share.limit_interval = 1 / fps if fps else 0.
+        share.limit_reason = reason if fps else None
+
+    @staticmethod
+    def _interval(share: Share) -> float:
+        return max(share.min_interval, share.limit_interval)
+
+    def _is_eligible(self, share: Share, now: float) -> bool:
+        return now - share.dispatched_at >= self._interval(share) and now >= share.held_until
+
+    def select(self, candidates: Iterable[UUID]) -> Optional[UUID]:
+        now = time.monotonic()
+        best, best_start = None, 0.
+        for uuid in candidates:
+            share = self.shares[uuid]
+            if not self._is_eligible(share, now):
+                continue
+            # idle cameras join at the current virtual time instead of catching up on the time they missed
+            start = max(self._virtual_time, share.finish)
+            if best is None or start < best_start:
+                best, best_start = uuid, start
+        return best
+
+    def time_to_eligible(self, candidates: Iterable[UUID]) -> Optional[float]:
+        # seconds until the first rate limited candidate may be dispatched, None without candidates
+        now = time.monotonic()
+        waits = [
+            max(self._interval(self.shares[uuid]) - (now - self.shares[uuid].dispatched_at),
+                self.shares[uuid].held_until - now)
+            for uuid in candidates
+        ]
+        return max(0., min(waits)) if waits else None
+
+    def hold(self, uuid: UUID, seconds: float) -> None:
+        # a frame of the camera was looked at but not dispatched, e.g. rejected by the motion gate
+        self.shares[uuid].held_until = time.monotonic() + seconds
+
+    def dispatched(self, uuid: UUID, delay: float) -> None:
+        share = self.shares[uuid]
+        start = max(self._virtual_time, share.finish)
+        share.finish = start + 1 / share.weight
+        self._virtual_time = start
+        share.dispatched_at = time.monotonic()
+
+        share.frames += 1
+        share.delay_sum += delay
+        share.delay_max = max(share.delay_max, delay)
+
+    def stats(self) -> dict[UUID, dict]:
+        # achieved fps and queueing delay (frame decode to inference request) since the previous call
+        now = time.monotonic()
+        elapsed = max(now - self._stats_since, 1e-6)
+        stats = {}
+        for uuid, share in self.shares.items():
+            stats[uuid] = {
+                'fps': share.frames / elapsed,
+                'delay_avg_ms': share.delay_sum / share.frames * 1000 if share.frames else 0.,
+                'delay_max_ms': share.delay_max * 1000,
+            }
+            share.frames, share.delay_sum, share.delay_max = 0, 0., 0.
+        self._stats_since = now
+        return stats
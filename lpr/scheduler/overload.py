@@ -0,0 +1,60 @@
+import logging
+import time
+from typing import Optional
+
+from data.config import config
+
+
+class OverloadController:
+    # load shedding steps, each level keeps the measures of the levels below it
+    NORMAL, THROTTLE_OCCUPIED, SKIP_LOW_QUALITY, PAUSE_IDLE = range(4)
+
+    ENABLED = config['overload']['enabled']
+    HIGH_DELAY = config['overload']['high_delay']
+    LOW_DELAY = config['overload']['low_delay']
+    DWELL = config['overload']['dwell']
+    SMOOTHING = config['overload']['smoothing']
+    OCCUPIED_FPS = config['overload']['occupied_fps']
+    IDLE_FPS = config['overload']['idle_fps']
+    MIN_QUALITY = config['overload']['min_quality']
+
+    def __init__(self):
+        self.level = self.NORMAL
+        self.delay = 0.  # smoothed queueing delay of dispatched plate frames and char crops, seconds
+        self._changed_at = time.monotonic()
+        self._observed_at = 0.
+
+    def observe(self, delay: float) -> None:
+        self.delay += self.SMOOTHING * (delay - self.delay)
+        self._observed_at = time.monotonic()
+
+    def update(self, backlog: float = 0.) -> None:
+        # one level per dwell period, so the effect of a step is measured before the next one.
+        # backlog is the age of the oldest work still waiting: a stalled queue dispatches nothing to observe,
+        # and the newest-first char queue dispatches the fresh crops ahead of the old ones
+        now = time.monotonic()
+        if not self.ENABLED or now - self._changed_at < self.DWELL:
+            return
+        if now - self._observed_at > self.DWELL:
+            self.delay = 0.  # nothing was dispatched lately
+        delay = max(self.delay, backlog)
+        if delay > self.HIGH_DELAY and self.level < self.PAUSE_IDLE:
+            self.level += 1
+            logging.warning(f'Overload - queueing delay {delay * 1000:.0f} ms, level {self.level}.')
+        elif delay < self.LOW_DELAY and self.level > self.NORMAL:
+            self.level -= 1
+            logging.info(f'Overload - queueing delay {delay * 1000:.0f} ms, level {self.level}.')
+        else:
+            return
+        self._changed_at = now
+
+    def plate_limit(self, is_occupied: bool) -> tuple[Optional[str], float]:
+        # drop reason and plate inference fps limit of a camera, 0 - no limit
+        if is_occupied and self.level >= self.THROTTLE_OCCUPIED:
+            return 'overload_throttled', self.OCCUPIED_FPS
+        if not is_occupied and self.level >= self.PAUSE_IDLE:
+            return 'overload_paused', self.IDLE_FPS
+        return None, 0
+
+    def skips_char_inference(self, quality: float) -> bool:
+        return self.level >= self.SKIP_LOW_QUALITY and quality < self.MIN_QUALITY
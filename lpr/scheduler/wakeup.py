@@ -0,0 +1,18 @@
+from collections import Counter
+from threading import Event
+
+
+class Wakeup:
+    # the scheduler sleeps until a producer signals new work: a decoded frame, a finished request, a plate crop
+    def __init__(self):
+        self._event = Event()
+        self.counters = Counter()
+
+    def notify(self, reason: str) -> None:
+        self.counters[reason] += 1
+        self._event.set()
+
+    def wait(self, timeout: float) -> None:
+        # signals raised while the scheduler was busy are kept, so the next wait returns at once
+        self._event.wait(timeout)
+        self._event.clear()
@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+from threading import Thread
+from typing import Iterable
+from uuid import UUID
+
+from data.config import config
+
+KEY_PREFIX = 'lpr:nodes:'
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    # consistent hashing: a node joining or leaving moves only the cameras of its own ring arcs
+    def __init__(self, nodes: Iterable[str], replicas: int):
+        self._points = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self._keys = [point for point, _ in self._points]
+
+    def owner(self, key: str) -> str:
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._points[index][1]
+
+
+class ShardMembership:
+    # lpr nodes register in Redis with a heartbeat key, every node computes the same camera assignment
+    # from the set of live nodes
+    REDIS_URL = config['sharding']['redis_url']
+    HEARTBEAT = config['sharding']['heartbeat']
+    TTL = config['sharding']['ttl']
+    REPLICAS = config['sharding']['replicas']
+
+    def __init__(self, node_id: str = None):
+        import redis  # only sharded deployments need it
+
+        self.node_id = node_id or os.getenv('LPR_NODE_ID') or socket.gethostname()
+        self._redis = redis.Redis.from_url(self.REDIS_URL)
+        self._register()
+        self.nodes = self._live_nodes()
+
+        thread = Thread(target=self._heartbeat)
+        thread.daemon = True
+        thread.start()
+
+    def _register(self) -> None:
+        self._redis.set(f'{KEY_PREFIX}{self.node_id}', time.time(), ex=self.TTL)
+
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(self.HEARTBEAT)
+            try:
+                self._register()
+            except Exception as e:
+                logging.warning(f'Shard heartbeat failed: {e}')
+
+    def _live_nodes(self) -> frozenset[str]:
+        keys = self._redis.scan_iter(match=f'{KEY_PREFIX}*')
+        nodes = {key.decode()[len(KEY_PREFIX):] for key in keys}
+        return frozenset(nodes | {self.node_id})
+
+    def refresh(self) -> bool:
+        # True if a node has joined or died since the previous call
+        try:
+            nodes = self._live_nodes()
+        except Exception as e:
+            logging.warning(f'Shard membership check failed: {e}')
+            return False
+        if nodes == self.nodes:
+            return False
+        logging.info(f'Shard nodes changed: {sorted(self.nodes)} -> {sorted(nodes)}')
+        self.nodes = nodes
+        return True
+
+    def assign(self, cameras: dict[UUID, dict]) -> dict[UUID, dict]:
+        ring = HashRing(self.nodes, self.REPLICAS)
+        return {uuid: camera for uuid, camera in cameras.items() if ring.owner(str(uuid)) == self.node_id}
@@ -0,0 +1,44 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from data.config import config
+
+
+class MotionDetector:
+    WIDTH = config['motion']['width']
+    PIXEL_THRESHOLD = config['motion']['pixel_threshold']
+    SENSITIVITY = config['motion']['sensitivity']
+    BACKGROUND_RATE = config['motion']['background_rate']
+
+    def __init__(self, roi: dict, sensitivity: Optional[float] = None):
+        self.roi = roi  # relative borders of the detector roi: x_min, x_max, y_min, y_max
+        self.sensitivity = self.SENSITIVITY if sensitivity is None else sensitivity  # share of changed pixels
+        self._background: Optional[np.ndarray] = None
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        x_min, x_max = int(self.roi['x_min'] * w), int(self.roi['x_max'] * w)
+        y_min, y_max = int(self.roi['y_min'] * h), int(self.roi['y_max'] * h)
+        region = frame[y_min:y_max, x_min:x_max]
+
+        rh, rw = region.shape[:2]
+        size = self.WIDTH, max(1, rh * self.WIDTH // max(rw, 1))
+        small = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def update(self, frame: np.ndarray) -> bool:
+        gray = self._prepare(frame)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        changed = np.count_nonzero(diff > self.PIXEL_THRESHOLD) / diff.size
+        cv2.accumulateWeighted(gray, self._background, self.BACKGROUND_RATE)
+        return changed > self.sensitivity
+
+    def reset(self) -> None:
+        self._background = None
@@ -0,0 +1,125 @@
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+HEADER = 2  # int64 fields: latest slot index, last sequence number
+LATEST, SEQUENCE = range(HEADER)
+
+
+class FrameRef:
+    # pinned slot of a FrameRing, the slot is not overwritten until the reference is released
+    __slots__ = 'ring', 'index', 'seq', 'image'
+
+    def __init__(self, ring: 'FrameRing', index: int, seq: int):
+        self.ring = ring
+        self.index = index
+        self.seq = seq
+        self.image = ring.slot(index)
+
+    def pin(self) -> 'FrameRef':
+        # another reference to the same slot, released on its own
+        self.ring.pin(self.index)
+        return FrameRef(self.ring, self.index, self.seq)
+
+    def release(self) -> None:
+        if self.ring is not None:
+            self.ring.release(self.index)
+            self.ring = None
+            self.image = None
+
+
+class FrameRing:
+    # fixed number of preallocated frame slots of one camera: the capture side decodes straight into a free slot
+    # and publishes it as the latest frame, consumers pop the latest frame and pin its slot while they use it.
+    # Slot state lives in the same buffer as the frames, so a shared ring works across processes as well.
+    def __init__(self, shape: tuple, size: int, lock=None, shared: bool = False, name: Optional[str] = None):
+        self.shape = tuple(shape)
+        self.size = size
+        self._lock = lock or Lock()
+
+        frame_bytes = int(np.prod(self.shape))
+        meta_bytes = (HEADER + 2 * size) * 8
+        self._shm = None
+        if shared or name is not None:
+            self._shm = SharedMemory(name=name, create=name is None, size=meta_bytes + size * frame_bytes)
+            buffer = self._shm.buf
+        else:
+            buffer = np.zeros(meta_bytes + size * frame_bytes, np.uint8)  # pages are committed on first write
+
+        meta = np.ndarray((HEADER + 2 * size,), np.int64, buffer)
+        self._header = meta[:HEADER]
+        self._seqs = meta[HEADER:HEADER + size]
+        self._pins = meta[HEADER + size:]
+        self._frames = np.ndarray((size, *self.shape), np.uint8, buffer, offset=meta_bytes)
+        if name is None:
+            meta[:] = 0
+            self._header[LATEST] = -1
+        self._next = 0
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._shm.name if self._shm is not None else None
+
+    def slot(self, index: int) -> np.ndarray:
+        return self._frames[index]
+
+    def claim(self) -> Optional[int]:
+        # free slot for the next frame: not pinned and not the latest unconsumed frame, None if every slot is in use
+        with self._lock:
+            latest = self._header[LATEST]
+            for offset in range(self.size):
+                index = (self._next + offset) % self.size
+                if self._pins[index] == 0 and index != latest:
+                    self._next = (index + 1) % self.size
+                    return index
+        return None
+
+    def publish(self, index: int) -> bool:
+        # makes a claimed slot the latest frame, returns False if the previous latest frame was never consumed
+        with self._lock:
+            self._header[SEQUENCE] += 1
+            self._seqs[index] = self._header[SEQUENCE]
+            is_consumed = self._header[LATEST] < 0
+            self._header[LATEST] = index
+        return is_consumed
+
+    def pop(self) -> Optional[FrameRef]:
+        with self._lock:
+            index = int(self._header[LATEST])
+            if index < 0:
+                return None
+            self._header[LATEST] = -1
+            self._pins[index] += 1
+            seq = int(self._seqs[index])
+        return FrameRef(self, index, seq)
+
+    def pin(self, index: int) -> None:
+        with self._lock:
+            self._pins[index] += 1
+
+    def release(self, index: int) -> None:
+        with self._lock:
+            if self._pins is not None:  # a closed ring has no slots to free
+                self._pins[index] -= 1
+
+    @property
+    def has_frame(self) -> bool:
+        return self._header[LATEST] >= 0
+
+    @property
+    def pinned(self) -> int:
+        return int(np.count_nonzero(self._pins))
+
+    def close(self, unlink: bool = False) -> None:
+        if self._shm is None:
+            return
+        # numpy views keep the mapping alive, they go first
+        self._header = self._seqs = self._pins = self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # a slot view is still alive, the mapping goes away with it
+        if unlink:
+            self._shm.unlink()
@@ -1,15 +1,69 @@
 import logging
 import time
+from collections import Counter
 from threading import Thread, Lock
-from typing import Optional
+from typing import Callable, Optional
 from uuid import UUID
 
 import cv2
-import numpy as np
 
+from data.config import config
+from stream.ring import FrameRing, FrameRef
 
-class Stream:
+
+class StreamState:
+    # capture state written by the capture loop and read by the consumer (and the other way round)
+    def __init__(self):
+        self.frame_requested = True
+        self.last_decode = 0.
+        self.counters = Counter(grabbed=0, decoded=0, consumed=0, overwritten=0, ring_full=0)
+
+
+class FrameSource:
+    # consumer side of a stream: the latest frame of its ring, decode requests and counters
+    RING_SIZE = config['stream']['ring_size']
+
+    def __init__(self, state: StreamState):
+        self._state = state
+        self._ring: Optional[FrameRing] = None
+        self.frame_lock = Lock()
+
+    @property
+    def counters(self):
+        return self._state.counters
+
+    @property
+    def _has_frame(self) -> bool:
+        return self._ring is not None and self._ring.has_frame
+
+    @property
+    def is_pending(self) -> bool:
+        return self._has_frame
+
+    @property
+    def frame_age(self) -> Optional[float]:
+        # seconds since the pending frame was decoded
+        if not self._has_frame:
+            return None
+        return time.monotonic() - self._state.last_decode
+
+    def pop_frame(self) -> Optional[FrameRef]:
+        # the returned frame pins its ring slot, the consumer releases it once the image is no longer used
+        frame = self._ring.pop() if self._ring is not None else None
+        if frame is not None:
+            self.counters['consumed'] += 1
+        return frame
+
+    def request_frame(self) -> None:
+        # grab mode decodes the next grabbed frame, the consumer asks shortly before it is going to pop it
+        self._state.frame_requested = True
+        logging.debug(f'Frame requested by receiver.')
+
+
+class Stream(FrameSource):
     RECONNECTION_DELAY = 5
+    CAPTURE_MODE = config['stream']['capture_mode']
+    TARGET_FPS = config['stream']['target_fps']
 
     def __init__(
             self,
@@ -19,8 +73,14 @@ class Stream:
             port: str = None,
             link: str = None,
             user: str = None,
-            password: str = None
+            password: str = None,
+            capture_mode: str = None,
+            target_fps: float = None,
+            on_frame: Callable[[], None] = None,
+            state: StreamState = None,
+            ring_factory: Callable[[tuple], FrameRing] = None,
     ):
+        super().__init__(state or StreamState())
         if url is not None:
             self._url = url
         elif ip is not None and port is not None:
@@ -32,8 +92,12 @@ class Stream:
             self._stop_flag = False
             self._dropped = False
             self._thread = None
-            self._frame = None
-            self.frame_lock = Lock()
+            self._ring_factory = ring_factory or (lambda shape: FrameRing(shape, self.RING_SIZE))
+
+            # 'read' decodes every frame, 'grab' decodes only requested frames (or at target_fps)
+            self._capture_mode = capture_mode or self.CAPTURE_MODE
+            self._target_fps = self.TARGET_FPS if target_fps is None else target_fps
+            self._on_frame = on_frame  # wakes the scheduler up, also when the stream drops and needs reconnection
 
             self._open(initial=True)
         else:
@@ -54,12 +118,36 @@ class Stream:
             self._stream = cv2.VideoCapture(self._url)
             logging.info(f'Stream connected.')
             while self.is_open:
-                ret, frame = self._stream.read()
+                if not self._stream.grab():
+                    break
+                self.counters['grabbed'] += 1
+                if self._capture_mode == 'grab' and not self._is_decode_due():
+                    continue
+
+                # frames are decoded straight into a free ring slot
+                ring = self._ring
+                index = ring.claim() if ring is not None else None
+                if ring is not None and index is None:
+                    self.counters['ring_full'] += 1  # every slot is pinned, the frame is skipped
+                    continue
+                ret, frame = self._stream.retrieve(ring.slot(index) if ring is not None else None)
                 if not ret:
                     break
+                self.counters['decoded'] += 1
+                if ring is None or frame.shape != ring.shape:
+                    # first frame or new resolution, frames pinned in the old ring stay valid until released
+                    ring = self._ring = self._ring_factory(frame.shape)
+                    index = ring.claim()
+                    ring.slot(index)[:] = frame
 
                 with self.frame_lock:
-                    self._frame = frame
+                    # timestamp goes first, a consumer in another process must not see the frame without it
+                    self._state.last_decode = time.monotonic()
+                    self._state.frame_requested = False
+                    if not ring.publish(index):
+                        self.counters['overwritten'] += 1  # decoded but never consumed
+                if self._on_frame is not None:
+                    self._on_frame()
 
         except Exception as e:
             logging.warning(f"Error reading the stream: {e}")
@@ -68,25 +156,41 @@ class Stream:
             if self._stream:
                 self._stream.release()
             self._dropped = True
+            if self._on_frame is not None:
+                self._on_frame()
+
+    def _is_decode_due(self) -> bool:
+        if self._state.frame_requested:
+            return True
+        return bool(self._target_fps) and time.monotonic() - self._state.last_decode >= 1 / self._target_fps
 
     @property
     def is_open(self) -> bool:
         return not self._stop_flag and (self._stream is not None) and self._stream.isOpened()
 
+    @property
+    def is_pending(self) -> bool:
+        # a decoded frame waits for pop_frame, or a dropped stream waits for pop_frame to reconnect it
+        return super().is_pending or (self._dropped and not self._stop_flag)
+
+    @property
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
     @property
     def url(self) -> str:
         return self._url
 
-    def pop_frame(self) -> Optional[np.ndarray]:
+    def reconnect_if_dropped(self) -> bool:
         if self._dropped and not self._stop_flag:
             self._open()
-            return None
-
-        frame = self._frame
-        self._frame = None
+            return True
+        return False
 
-        logging.debug(f'Frame requested by receiver.')
-        return frame
+    def pop_frame(self) -> Optional[FrameRef]:
+        if self.reconnect_if_dropped():
+            return None
+        return super().pop_frame()
 
     def _open(self, initial: bool = False) -> None:
         self._dropped = False
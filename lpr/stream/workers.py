@@ -0,0 +1,239 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+from collections import Counter
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+from threading import Thread
+from typing import Callable, Optional
+from uuid import UUID
+
+import numpy as np
+
+from data.config import config
+from stream.ring import FrameRing
+from stream.streams import FrameSource, Stream
+
+COUNTERS = 'grabbed', 'decoded', 'consumed', 'overwritten', 'ring_full'
+
+
+def worker_count() -> int:
+    # 0 - capture threads in the lpr process, -1 - one process per 4 cores
+    workers = config['stream']['capture_workers']
+    if workers < 0:
+        return max(1, (os.cpu_count() or 1) // 4)
+    return workers
+
+
+class SharedCounters:
+    def __init__(self, values: np.ndarray):
+        self._values = values
+
+    def __getitem__(self, key: str) -> int:
+        return int(self._values[COUNTERS.index(key)])
+
+    def __setitem__(self, key: str, value: int) -> None:
+        self._values[COUNTERS.index(key)] = value
+
+
+class SharedStreamState:
+    # StreamState in a named shared memory block: created by the lpr process, attached by name in the capture
+    # worker the camera is opened in, so it can be handed over to a worker that is already running
+    def __init__(self, ring_lock, name: Optional[str] = None):
+        self._shm = SharedMemory(name=name, create=name is None, size=(2 + len(COUNTERS)) * 8)
+        self._last_decode = np.ndarray((1,), np.float64, self._shm.buf)
+        values = np.ndarray((1 + len(COUNTERS),), np.int64, self._shm.buf, offset=8)
+        if name is None:
+            self._last_decode[0] = 0.
+            values[:] = 0
+            values[0] = 1
+        self._frame_requested = values[:1]
+        self.counters = SharedCounters(values[1:])
+        self.ring_lock = ring_lock  # lock of the worker the camera is captured in, shared by its rings
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def frame_requested(self) -> bool:
+        return bool(self._frame_requested[0])
+
+    @frame_requested.setter
+    def frame_requested(self, value: bool) -> None:
+        self._frame_requested[0] = value
+
+    @property
+    def last_decode(self) -> float:
+        return float(self._last_decode[0])
+
+    @last_decode.setter
+    def last_decode(self, value: float) -> None:
+        self._last_decode[0] = value
+
+    def close(self, unlink: bool = False) -> None:
+        # numpy views keep the mapping alive, they go first
+        self._last_decode = self._frame_requested = self.counters = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+        if unlink:
+            self._shm.unlink()
+
+
+class RemoteStream(FrameSource):
+    # lpr process side of a stream captured by a worker process, reconnection is the worker's job
+    def __init__(self, uuid: UUID, state: SharedStreamState, generation: int):
+        super().__init__(state)
+        self._id = uuid
+        self.generation = generation  # announcements of an earlier open of the same camera are dropped
+
+    def attach(self, name: str, shape: tuple) -> None:
+        try:
+            ring = FrameRing(shape, self.RING_SIZE, lock=self._state.ring_lock, name=name)
+        except FileNotFoundError:
+            return  # the worker has replaced that ring already, its successor is announced next
+        self._ring = ring
+
+    def close(self) -> None:
+        self._state.close(unlink=True)
+
+
+class SharedRingFactory:
+    # creates the shared ring of a worker stream and announces it to the lpr process
+    def __init__(self, uuid: UUID, generation: int, state: SharedStreamState, events):
+        self._uuid = uuid
+        self._generation = generation
+        self._state = state
+        self._events = events
+        self._ring: Optional[FrameRing] = None
+
+    def __call__(self, shape: tuple) -> FrameRing:
+        previous = self._ring
+        self._ring = FrameRing(shape, Stream.RING_SIZE, lock=self._state.ring_lock, shared=True)
+        self._events.put(('ring', self._uuid, self._generation, self._ring.name, shape))
+        if previous is not None:
+            # frames pinned by the lpr process stay mapped there after unlink
+            previous.close(unlink=True)
+        return self._ring
+
+    def close(self) -> None:
+        if self._ring is not None:
+            self._ring.close(unlink=True)
+
+
+def run_worker(ring_lock, events, commands, stop) -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parent = os.getppid()
+    streams: dict[UUID, tuple[Stream, SharedRingFactory, SharedStreamState]] = {}
+    closing: list[tuple[Stream, SharedRingFactory, SharedStreamState]] = []
+    # the lpr process does not poll for reconnection here, so dropped streams are reopened by the worker
+    while not stop.wait(1) and os.getppid() == parent:
+        while not commands.empty():
+            command, uuid, *args = commands.get()
+            if command == 'open':
+                generation, kwargs, state_name = args
+                try:
+                    state = SharedStreamState(ring_lock, name=state_name)
+                except FileNotFoundError:
+                    continue  # the camera was closed before the worker got to open it
+                factory = SharedRingFactory(uuid, generation, state, events)
+                stream = Stream(
+                    uuid=uuid,
+                    **kwargs,
+                    state=state,
+                    ring_factory=factory,
+                    on_frame=partial(events.put, ('frame', uuid)),
+                )
+                streams[uuid] = stream, factory, state
+            elif command == 'close' and uuid in streams:
+                stream, factory, state = streams.pop(uuid)
+                stream.close()
+                closing.append((stream, factory, state))
+        for stream, _, _ in streams.values():
+            stream.reconnect_if_dropped()
+        # a ring is unlinked once its capture thread has stopped writing into it
+        for item in [item for item in closing if not item[0].is_alive]:
+            stream, factory, state = item
+            factory.close()
+            state.close()
+            closing.remove(item)
+
+    for stream, factory, state in list(streams.values()) + closing:
+        stream.close()
+        factory.close()
+        state.close()
+
+
+class CaptureWorkers:
+    # cameras are captured and decoded in a fixed pool of worker processes started once, an opened camera goes
+    # to the worker with the fewest cameras. Frames reach the lpr process through shared memory rings, only open
+    # and close commands, ring announcements and wakeups go through queues.
+    def __init__(self, workers: int, on_frame: Optional[Callable[[], None]] = None):
+        self._ctx = mp.get_context('spawn')  # the lpr process runs OpenVINO threads, it must not be forked
+        self._events = self._ctx.SimpleQueue()
+        self._stop = self._ctx.Event()
+        self._on_frame = on_frame
+        self._processes = []
+        self._commands = []
+        self._locks = []
+        self._assigned: dict[UUID, int] = {}  # camera -> worker index
+        self._generations = itertools.count()  # an edited camera is reopened under the same uuid
+        self.streams: dict[UUID, RemoteStream] = {}
+
+        for _ in range(max(1, workers)):
+            commands, ring_lock = self._ctx.SimpleQueue(), self._ctx.Lock()
+            process = self._ctx.Process(
+                target=run_worker, args=(ring_lock, self._events, commands, self._stop), daemon=True)
+            process.start()
+            self._processes.append(process)
+            self._commands.append(commands)
+            self._locks.append(ring_lock)
+
+        self._listener = Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def open(self, cameras: dict[UUID, dict]) -> dict[UUID, RemoteStream]:
+        streams = {}
+        load = Counter(self._assigned.values())
+        for uuid, kwargs in cameras.items():
+            worker = min(range(len(self._processes)), key=lambda i: load[i])
+            load[worker] += 1
+            state = SharedStreamState(self._locks[worker])
+            generation = next(self._generations)
+            streams[uuid] = RemoteStream(uuid, state, generation)
+            self._assigned[uuid] = worker
+            self._commands[worker].put(('open', uuid, generation, kwargs, state.name))
+        self.streams.update(streams)
+        if streams:
+            alive = sum(process.is_alive() for process in self._processes)
+            logging.info(f'Capture workers: {alive}/{len(self._processes)} process(es), '
+                         f'{len(self.streams)} camera(s).')
+        return streams
+
+    def close_streams(self, uuids) -> None:
+        for uuid in uuids:
+            stream = self.streams.pop(uuid, None)
+            worker = self._assigned.pop(uuid, None)
+            if worker is not None:
+                self._commands[worker].put(('close', uuid))
+            if stream is not None:
+                stream.close()
+    def _listen(self) -> None:
+        while True:
+            event = self._events.get()
+            if event[0] == 'ring':
+                _, uuid, generation, name, shape = event
+                stream = self.streams.get(uuid)
+                if stream is not None and stream.generation == generation:
+                    stream.attach(name, shape)
+            if self._on_frame is not None:
+                self._on_frame()
+
+    def close(self) -> None:
+        self._stop.set()
+        for process in self._processes:
+            process.join()
+        self.close_streams(list(self.streams))
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# lpr modules import each other from the lpr directory, the way main.py runs
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,55 @@
+import time
+from uuid import uuid4
+
+import numpy as np
+
+import stream.streams as streams
+from stream.streams import Stream
+
+
+class FakeCapture:
+    # endless 25 fps camera, retrieve decodes into the given buffer like cv2.VideoCapture does
+    SHAPE = (48, 64, 3)
+
+    def __init__(self, url):
+        self.grabbed = 0
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        time.sleep(0.04)
+        self.grabbed += 1
+        return True
+
+    def retrieve(self, image=None):
+        if image is None:
+            image = np.empty(self.SHAPE, np.uint8)
+        image[:] = self.grabbed % 256
+        return True, image
+
+    def release(self):
+        pass
+
+
+def test_grab_mode_consumer_gets_frames(monkeypatch):
+    monkeypatch.setattr(streams.cv2, 'VideoCapture', FakeCapture)
+    stream = Stream(uuid4(), ip='127.0.0.1', port='554', link='', capture_mode='grab', target_fps=0)
+    try:
+        # a consumer outside LPRSystem, like tools.collect_frames: pop, then request the next frame
+        received = 0
+        deadline = time.monotonic() + 5
+        while received < 3 and time.monotonic() < deadline:
+            frame = stream.pop_frame()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            assert frame.image.shape == FakeCapture.SHAPE
+            frame.release()
+            received += 1
+            stream.request_frame()
+            time.sleep(0.2)  # frames grabbed meanwhile are not decoded
+        assert received == 3
+        assert stream.counters['decoded'] < stream.counters['grabbed']
+    finally:
+        stream.close()
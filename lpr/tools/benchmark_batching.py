@@ -0,0 +1,66 @@
+# Compares plate detection throughput of the single-frame path and the cross-stream batching path.
+# Usage (from the lpr directory): python -m tools.benchmark_batching --images ./samples --batch-sizes 1 4 8
+import argparse
+import time
+from threading import Lock
+
+import numpy as np
+
+from data.config import config
+from predictors.base import QueuedPredictor
+from tools.dataset import load_frames
+
+
+def run(batch_size: int, frames: list[np.ndarray], streams: int, duration: float) -> dict:
+    lock = Lock()
+    done = [0]
+
+    def callback(_):
+        with lock:
+            done[0] += 1
+
+    model_config = dict(config['models']['plate'], batch_size=batch_size)
+    predictor = QueuedPredictor(callback=callback, **model_config)
+
+    # warm up, so compilation and first-inference costs are not measured
+    for i in range(max(batch_size, 1) * 2):
+        predictor.add_frame(frames[i % len(frames)], userdata={'stream': i % streams})
+    predictor.wait_all()
+    done[0] = 0
+
+    submitted = 0
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    while time.perf_counter() - wall_start < duration:
+        if predictor.is_ready:
+            predictor.add_frame(frames[submitted % len(frames)], userdata={'stream': submitted % streams})
+            submitted += 1
+        else:
+            predictor.flush()
+    predictor.wait_all()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    return {
+        'batch_size': batch_size,
+        'frames': done[0],
+        'fps': done[0] / wall,
+        'fps_per_core': done[0] / cpu if cpu else 0.,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='', help='directory with sample frames, random frames if empty')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--streams', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.)
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, args.streams)
+    print(f'{"batch":>6} {"frames":>8} {"fps":>8} {"fps/core":>9}')
+    for batch_size in args.batch_sizes:
+        result = run(batch_size, frames, args.streams, args.duration)
+        print(f'{result["batch_size"]:>6} {result["frames"]:>8} {result["fps"]:>8.1f} {result["fps_per_core"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Compares the numpy and torch postprocess backends: import time, per-call latency, peak RSS and outputs.
+# Every backend is measured in its own process, so the RSS of one does not leak into the other.
+# Latency is reported for a growing number of candidate boxes, it should stay flat with postprocess.max_masks.
+# Usage (from the lpr directory): python -m tools.benchmark_postprocess --calls 500 --candidates 5 40 200
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+INPUT_HW = 384, 640
+ORIGINAL_SHAPE = 1080, 1920, 3
+NUMBER_CLASSES = 6
+NUMBER_MASKS = 32
+
+
+def synthetic_outputs(seed: int, candidates: int = 40) -> tuple[np.ndarray, np.ndarray]:
+    # plate model outputs for one frame: mostly background anchors and a few confident candidates
+    rng = np.random.default_rng(seed)
+    h, w = INPUT_HW
+    anchors = sum((h // s) * (w // s) for s in (8, 16, 32))
+    boxes = np.zeros((1, 4 + NUMBER_CLASSES + NUMBER_MASKS, anchors), np.float32)
+    boxes[0, 0], boxes[0, 1] = rng.uniform(0, w, anchors), rng.uniform(0, h, anchors)
+    boxes[0, 2], boxes[0, 3] = rng.uniform(10, 120, anchors), rng.uniform(5, 40, anchors)
+    boxes[0, 4:4 + NUMBER_CLASSES] = rng.uniform(0, 0.2, (NUMBER_CLASSES, anchors))
+    confident = rng.choice(anchors, candidates, replace=False)
+    boxes[0, 4:4 + NUMBER_CLASSES, confident] = rng.uniform(0, 1, (candidates, NUMBER_CLASSES))
+    boxes[0, 4 + NUMBER_CLASSES:] = rng.normal(0, 1, (NUMBER_MASKS, anchors))
+    masks = rng.normal(0, 1, (1, NUMBER_MASKS, h // 4, w // 4)).astype(np.float32)
+    return boxes, masks
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(backend: str, calls: int, candidates: int) -> dict:
+    import_start = time.perf_counter()
+    if backend == 'torch':
+        import torch, torchvision  # noqa: F401, the torch backend imports them on the first call
+    from predictors.utils import postprocess_outputs
+    import_time = time.perf_counter() - import_start
+
+    samples = [synthetic_outputs(seed, candidates) for seed in range(16)]
+    # the torch backend converts boxes in place, so every call gets a copy
+    postprocess_outputs(samples[0][0].copy(), samples[0][1], INPUT_HW, [ORIGINAL_SHAPE], NUMBER_CLASSES,
+                        backend=backend)
+
+    latencies = []
+    detections = []
+    for i in range(calls):
+        boxes, masks = samples[i % len(samples)]
+        start = time.perf_counter()
+        result = postprocess_outputs(boxes.copy(), masks, INPUT_HW, [ORIGINAL_SHAPE], NUMBER_CLASSES, backend=backend)
+        latencies.append(time.perf_counter() - start)
+        if i < len(samples):
+            detections.append(np.asarray(result[0][0]).tolist())
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'backend': backend,
+        'candidates': candidates,
+        'import_s': import_time,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'max_rss_mb': max_rss_mb(),
+        'detections': detections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=['numpy', 'torch'])
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[40])
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.calls, args.candidates[0])))
+        return
+
+    results = []
+    for candidates in args.candidates:
+        for backend in args.backends:
+            output = subprocess.run(
+                [sys.executable, '-m', 'tools.benchmark_postprocess', '--worker', backend,
+                 '--calls', str(args.calls), '--candidates', str(candidates)],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                print(f'{backend}: failed\n{output.stderr}')
+                continue
+            results.append(json.loads(output.stdout))
+
+    print(f'{"backend":>8} {"boxes":>6} {"import s":>9} {"p50 ms":>8} {"p95 ms":>8} {"max rss MB":>11}')
+    for result in results:
+        print(f'{result["backend"]:>8} {result["candidates"]:>6} {result["import_s"]:>9.2f} {result["p50_ms"]:>8.2f} '
+              f'{result["p95_ms"]:>8.2f} {result["max_rss_mb"]:>11.1f}')
+
+    for candidates in args.candidates:
+        same_candidates = [result for result in results if result['candidates'] == candidates]
+        reference = same_candidates[0]
+        for result in same_candidates[1:]:
+            same = all(
+                np.shape(a) == np.shape(b) and np.allclose(a, b)
+                for a, b in zip(reference['detections'], result['detections'])
+            )
+            print(f'{candidates} boxes: {result["backend"]} outputs {"match" if same else "DIFFER from"} '
+                  f'{reference["backend"]}')
+
+
+if __name__ == '__main__':
+    main()
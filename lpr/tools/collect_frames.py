@@ -0,0 +1,56 @@
+# Saves frames of every camera registered in ACS, used as calibration data for tools/quantize.py.
+# Usage (from the lpr directory): python -m tools.collect_frames --output ./calibration --count 100 --interval 5
+import argparse
+import logging
+import os
+import time
+from uuid import UUID
+
+import cv2
+
+from config_setup import fetch_data
+from stream.streams import Stream
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--count', type=int, default=100, help='frames per camera')
+    parser.add_argument('--interval', type=float, default=5., help='seconds between frames of one camera')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    streams = {
+        UUID(stream['camera_id']): Stream(
+            uuid=stream['camera_id'],
+            ip=stream['stream_ip'],
+            port=stream['stream_port'],
+            link=stream['stream_path'],
+            user=stream['username'],
+            password=stream['password'],
+        ) for stream in fetch_data('streams/')
+    }
+
+    saved = {stream_uuid: 0 for stream_uuid in streams}
+    while any(count < args.count for count in saved.values()):
+        for stream_uuid, stream in streams.items():
+            if saved[stream_uuid] >= args.count:
+                continue
+            with stream.frame_lock:
+                frame = stream.pop_frame()
+            # grab mode decodes only requested frames, the next one is ready by the next round
+            stream.request_frame()
+            if frame is None:
+                continue
+            cv2.imwrite(os.path.join(args.output, f'{stream_uuid}_{saved[stream_uuid]:05d}.jpg'), frame.image)
+            frame.release()
+            saved[stream_uuid] += 1
+        logging.info(f'Saved {sum(saved.values())} frame(s).')
+        time.sleep(args.interval)
+
+    for stream in streams.values():
+        stream.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import glob
+import os
+from typing import Optional
+
+import cv2
+import numpy as np
+
+IMAGE_PATTERNS = '*.jpg', '*.jpeg', '*.png'
+MAX_PLATE_LENGTH = 10
+
+
+def image_paths(images_dir: str) -> list[str]:
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(images_dir, pattern)))
+    return sorted(paths)
+
+
+def load_frames(images_dir: str, count: int) -> list[np.ndarray]:
+    # random 1080p frames stand in when no sample directory is given
+    frames = []
+    if images_dir:
+        frames = [cv2.imread(path) for path in image_paths(images_dir)[:count]]
+    if not frames:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (1080, 1920, 3), dtype=np.uint8) for _ in range(count)]
+    return frames
+
+
+def plate_label(path: str) -> Optional[str]:
+    # labelled samples are named '<plate>_<anything>.jpg', e.g. 'a123bc77_0001.jpg',
+    # frames saved by tools.collect_frames ('<stream uuid>_00001.jpg') have no label
+    name = os.path.splitext(os.path.basename(path))[0]
+    label = name.split('_')[0].lower()
+    return label if label.isalnum() and len(label) <= MAX_PLATE_LENGTH else None
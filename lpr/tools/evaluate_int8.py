@@ -0,0 +1,95 @@
+# Side-by-side FP32 / INT8 comparison: per-model latency and throughput, plate string accuracy.
+# Samples named '<plate>_<anything>.jpg' are scored against the plate in the name,
+# other samples are scored by agreement with the FP32 result.
+# Usage (from the lpr directory): python -m tools.evaluate_int8 --images ./labelled
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+import openvino as ov
+from openvino import properties
+
+from data.config import config
+from tools.dataset import image_paths, plate_label
+from tools.pipeline import Recognizer
+
+PRECISIONS = {
+    'fp32': 'model_path',
+    'int8': 'int8_model_path',
+}
+
+
+def latency_ms(model_path: str, input_tensor: np.ndarray, runs: int) -> tuple[float, float]:
+    compiled_model = ov.Core().compile_model(model_path, 'CPU', config={
+        properties.hint.performance_mode(): properties.hint.PerformanceMode.LATENCY,
+    })
+    compiled_model(input_tensor)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        compiled_model(input_tensor)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def throughput_fps(model_path: str, input_tensor: np.ndarray, duration: float) -> float:
+    compiled_model = ov.Core().compile_model(model_path, 'CPU', config={
+        properties.hint.performance_mode(): properties.hint.PerformanceMode.CUMULATIVE_THROUGHPUT,
+    })
+    queue = ov.AsyncInferQueue(compiled_model)
+    done = [0]
+    queue.set_callback(lambda request, userdata: done.__setitem__(0, done[0] + 1))
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        queue.start_async({0: input_tensor})
+    queue.wait_all()
+    return done[0] / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', required=True)
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.)
+    args = parser.parse_args()
+
+    plate_config, char_config = config['models']['plate'], config['models']['char']
+    missing = [plate_config['int8_model_path'], char_config['int8_model_path']]
+    missing = [path for path in missing if not os.path.exists(path)]
+    if missing:
+        raise SystemExit(f'INT8 models not found: {missing}, run tools.quantize first.')
+
+    paths = image_paths(args.images)
+    frames = [cv2.imread(path) for path in paths]
+
+    recognitions = {}
+    print(f'{"model":>6} {"precision":>9} {"p50 ms":>8} {"p95 ms":>8} {"fps":>8}')
+    for precision, path_key in PRECISIONS.items():
+        recognizer = Recognizer(plate_config[path_key], char_config[path_key])
+        recognitions[precision] = [recognizer.recognize(frame) for frame in frames]
+
+        crop = next((c for c in map(recognizer.plate_crop, frames) if c is not None), None)
+        samples = {'plate': (plate_config, frames[0]), 'char': (char_config, crop)}
+        for name, (model_config, image) in samples.items():
+            if image is None:
+                continue
+            input_tensor = Recognizer.preprocess(image, model_config)
+            p50, p95 = latency_ms(model_config[path_key], input_tensor, args.runs)
+            fps = throughput_fps(model_config[path_key], input_tensor, args.duration)
+            print(f'{name:>6} {precision:>9} {p50:>8.2f} {p95:>8.2f} {fps:>8.1f}')
+
+    labels = [plate_label(path) for path in paths]
+    labelled = [i for i, label in enumerate(labels) if label is not None]
+    for precision, results in recognitions.items():
+        if labelled:
+            correct = sum(results[i] == labels[i] for i in labelled)
+            print(f'{precision}: {correct}/{len(labelled)} plates read correctly ({correct / len(labelled):.1%})')
+    agreement = sum(a == b for a, b in zip(recognitions['fp32'], recognitions['int8']))
+    print(f'int8 agrees with fp32 on {agreement}/{len(frames)} samples ({agreement / max(len(frames), 1):.1%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Synchronous plate -> char recognition of single images, shared by the quantization and evaluation tools.
+from typing import Optional
+
+import numpy as np
+import openvino as ov
+
+from data.config import config
+from predictors.processor import PlatePredictions, PlatePrediction, CharDetections
+from predictors.utils import letterbox_image, image_to_tensor, postprocess_outputs
+
+
+class Recognizer:
+    def __init__(self, plate_model_path: str, char_model_path: str, device: str = 'CPU'):
+        core = ov.Core()
+        self.plate_model = core.compile_model(plate_model_path, device)
+        self.char_model = core.compile_model(char_model_path, device)
+
+    @staticmethod
+    def preprocess(image: np.ndarray, model_config: dict) -> np.ndarray:
+        resized = letterbox_image(image, model_config['image_size'], model_config['stride'])
+        return image_to_tensor(resized)
+
+    def _infer(self, compiled_model, image: np.ndarray, model_config: dict) -> dict:
+        input_tensor = self.preprocess(image, model_config)
+        outputs = compiled_model(input_tensor)
+        boxes = outputs[compiled_model.output(0)]
+        masks = outputs[compiled_model.output(1)] if len(compiled_model.outputs) > 1 else None
+        [(det, seg)] = postprocess_outputs(
+            boxes, masks, input_tensor.shape[2:], [image.shape], model_config['number_classes']
+        )
+        return {'det': det, 'seg': seg}
+
+    def plate(self, frame: np.ndarray) -> Optional[PlatePrediction]:
+        result = self._infer(self.plate_model, frame, config['models']['plate'])
+        predictions = PlatePredictions(result, frame)
+        return predictions[0] if len(predictions) else None
+
+    def plate_crop(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        plate = self.plate(frame)
+        return plate.cropped if plate is not None else None
+
+    def read_crop(self, crop: np.ndarray) -> Optional[CharDetections]:
+        result = self._infer(self.char_model, crop, config['models']['char'])
+        if len(result['det']) == 0:
+            return None
+        return CharDetections(result, crop)
+
+    def recognize_crop(self, crop: np.ndarray) -> Optional[str]:
+        chars = self.read_crop(crop)
+        return chars.string if chars is not None else None
+
+    def recognize(self, frame: np.ndarray) -> Optional[str]:
+        crop = self.plate_crop(frame)
+        return self.recognize_crop(crop) if crop is not None else None
@@ -0,0 +1,56 @@
+# Post-training INT8 quantization of the plate and char IRs with NNCF (pip install -r requirements-tools.txt).
+# Plate model is calibrated on camera frames (tools/collect_frames.py), char model on plate crops of the same frames.
+# Usage (from the lpr directory): python -m tools.quantize --frames ./calibration
+import argparse
+import logging
+
+import cv2
+import nncf
+import openvino as ov
+
+from data.config import config
+from tools.dataset import image_paths
+from tools.pipeline import Recognizer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# detection head post-processing (DFL decoding, box arithmetic) loses accuracy when quantized
+IGNORED_SCOPE = nncf.IgnoredScope(types=['Multiply', 'Subtract', 'Sigmoid'])
+
+
+def quantize(model_config: dict, samples: list, subset_size: int) -> None:
+    model = ov.Core().read_model(model_config['model_path'])
+    dataset = nncf.Dataset(samples, lambda image: Recognizer.preprocess(image, model_config))
+    quantized = nncf.quantize(
+        model,
+        dataset,
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=min(subset_size, len(samples)),
+        ignored_scope=IGNORED_SCOPE,
+    )
+    ov.save_model(quantized, model_config['int8_model_path'])
+    logging.info(f'Saved {model_config["int8_model_path"]} ({len(samples)} calibration samples).')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', required=True, help='directory with calibration frames')
+    parser.add_argument('--subset-size', type=int, default=300)
+    parser.add_argument('--models', nargs='+', default=['plate', 'char'])
+    args = parser.parse_args()
+
+    plate_config, char_config = config['models']['plate'], config['models']['char']
+    frames = [cv2.imread(path) for path in image_paths(args.frames)]
+
+    if 'plate' in args.models:
+        quantize(plate_config, frames, args.subset_size)
+
+    if 'char' in args.models:
+        # crops come from the fp32 plate model, so the char model is calibrated on what it sees in production
+        recognizer = Recognizer(plate_config['model_path'], char_config['model_path'])
+        crops = [crop for crop in map(recognizer.plate_crop, frames) if crop is not None]
+        quantize(char_config, crops, args.subset_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Replays recorded vehicle passes through the event decision policies of predictors.voting.
+# Every pass is a directory '<plate>_<anything>' with its frames in name order, e.g. 'a123bc77_0001/00001.jpg'.
+# Frames are recognized once, then fed read by read to every policy, which is scored on the frames (char
+# inferences) it needed before its first decision and on misreads against the plate in the directory name.
+# Usage (from the lpr directory): python -m tools.replay_decisions --sequences ./passes --interval 0.2
+import argparse
+import os
+from uuid import uuid4
+
+import cv2
+
+from data.config import config
+from predictors.processor import CharDetections
+from predictors.voting import create_votes
+from tools.dataset import image_paths, plate_label
+from tools.pipeline import Recognizer
+
+POLICIES = 'count', 'consensus', 'sequential'
+
+
+def read_sequence(recognizer: Recognizer, sequence_dir: str) -> list[tuple[CharDetections, float]]:
+    reads = []
+    for path in image_paths(sequence_dir):
+        plate = recognizer.plate(cv2.imread(path))
+        if plate is None:
+            continue
+        chars = recognizer.read_crop(plate.cropped)
+        if chars is not None:
+            reads.append((chars, plate.conf))
+    return reads
+
+
+def replay(policy: str, reads: list[tuple[CharDetections, float]]) -> tuple[str, int]:
+    # first decision and the number of reads it took, (None, reads) without a decision
+    votes = create_votes(policy)
+    for i, (chars, plate_conf) in enumerate(reads, 1):
+        votes.add(uuid4(), chars, plate_conf)
+        decision = votes.decide()
+        if decision is not None:
+            return decision, i
+    return None, len(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequences', required=True)
+    parser.add_argument('--policies', nargs='+', default=list(POLICIES), choices=POLICIES)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between two plate inferences of a pass')
+    args = parser.parse_args()
+
+    recognizer = Recognizer(config['models']['plate']['model_path'], config['models']['char']['model_path'])
+    passes = []
+    for name in sorted(os.listdir(args.sequences)):
+        sequence_dir = os.path.join(args.sequences, name)
+        label = plate_label(name)
+        if os.path.isdir(sequence_dir) and label is not None:
+            passes.append((label, read_sequence(recognizer, sequence_dir)))
+    if not passes:
+        raise SystemExit(f'No labelled passes found in {args.sequences}.')
+
+    print(f'{"policy":>10} {"decided":>8} {"misread":>8} {"reads avg":>10} {"reads max":>10} {"time avg s":>11}')
+    for policy in args.policies:
+        results = [(label, *replay(policy, reads)) for label, reads in passes]
+        decided = [(label, decision, used) for label, decision, used in results if decision is not None]
+        misread = sum(decision != label for label, decision, _ in decided)
+        used = [used for _, _, used in decided] or [0]
+        print(f'{policy:>10} {len(decided):>4}/{len(passes):<3} {misread / max(len(decided), 1):>8.1%} '
+              f'{sum(used) / len(used):>10.1f} {max(used):>10} {sum(used) / len(used) * args.interval:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()